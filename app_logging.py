@@ -0,0 +1,106 @@
+"""Logging applicativo asincrono: coda limitata, scrittura e formattazione in un thread dedicato."""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from datetime import datetime
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Oltre questa frazione di coda occupata i messaggi DEBUG vengono scartati
+DEBUG_HIGH_WATER = 0.5
+
+class JsonFormatter(logging.Formatter):
+    # Un oggetto JSON per riga, per journald/Loki/jq
+    def format(self, record):
+        entry = {'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+                 'level': record.levelname, 'logger': record.name, 'thread': record.threadName,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # Non blocca mai il chiamante: sotto pressione si perdono prima i DEBUG, a coda piena tutto.
+    # Il record resta com'è (msg e args separati): la formattazione avviene nel thread di scrittura
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.high_water = max(1, int(log_queue.maxsize * DEBUG_HIGH_WATER)) if log_queue.maxsize > 0 else None
+        self.dropped = 0
+        self._reported = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        q = self.queue
+        if self.high_water is not None and record.levelno <= logging.DEBUG and q.qsize() >= self.high_water:
+            self._drop()
+            return
+        try:
+            lost = self.dropped - self._reported
+            if lost:
+                # Al primo posto libero si segnala quanti messaggi sono andati persi
+                q.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': 'Coda di log piena: scartati %d messaggi', 'args': (lost,)}))
+                with self._lock:
+                    self._reported += lost
+            q.put_nowait(record)
+        except queue.Full:
+            self._drop()
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+
+class LogPipeline:
+    # Handler reali (stdout, file a rotazione) dietro un QueueListener: il percorso di chiamata
+    # accoda soltanto, formattazione e I/O avvengono nel thread del listener
+    def __init__(self, level='INFO', log_file=None, json_format=False, max_bytes=10 * 2 ** 20, backup_count=5,
+                 queue_size=10000, stdout=True):
+        self.level = getattr(logging, str(level).upper(), logging.INFO)
+        formatter = JsonFormatter() if json_format else logging.Formatter(DEFAULT_FORMAT)
+        self.handlers = []
+        if stdout:
+            self.handlers.append(logging.StreamHandler(sys.stdout))
+        if log_file:
+            try:
+                self.handlers.append(logging.handlers.RotatingFileHandler(
+                    log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'))
+            except OSError as e:
+                print(f"File di log non disponibile ({log_file}): {e}", file=sys.stderr)
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.started = False
+
+    def start(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self.started = True
+        return self
+
+    def stop(self):
+        # Svuota la coda e chiude i file; i messaggi successivi vanno direttamente sugli handler
+        if not self.started:
+            return
+        self.started = False
+        self.listener.stop()
+        root = logging.getLogger()
+        root.removeHandler(self.handler)
+        for handler in self.handlers:
+            root.addHandler(handler)
+        if self.handler.dropped:
+            logging.getLogger(__name__).warning('Messaggi di log scartati in totale: %d', self.handler.dropped)
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.queue.maxsize, 'dropped': self.handler.dropped}
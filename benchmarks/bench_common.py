@@ -0,0 +1,56 @@
+"""Funzioni comuni dei benchmark: percentili, informazioni sulla macchina, salvataggio JSON."""
+import json
+import os
+import platform
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+def percentiles(samples, points=(50, 90, 99), scale=1000):
+    # Percentili (nearest rank) da campioni in secondi; scale 1000 = millisecondi, 1e6 = microsecondi
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {'count': len(ordered), 'min': ordered[0] * scale}
+    for p in points:
+        rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        result[f"p{p}"] = ordered[rank] * scale
+    result['max'] = ordered[-1] * scale
+    result['mean'] = sum(ordered) / len(ordered) * scale
+    return result
+
+def machine_info():
+    return {'host': platform.node(), 'machine': platform.machine(), 'system': platform.system(),
+            'release': platform.release(), 'python': platform.python_version(), 'cpus': os.cpu_count()}
+
+def git_revision():
+    try:
+        with open(os.path.join(REPO_DIR, '.git', 'HEAD'), 'r') as f:
+            head = f.read().strip()
+        if head.startswith('ref: '):
+            with open(os.path.join(REPO_DIR, '.git', head[5:]), 'r') as f:
+                return f.read().strip()[:12]
+        return head[:12]
+    except OSError:
+        return None
+
+def write_results(name, results, output=None):
+    # Un file JSON per esecuzione, confrontabile tra versioni e macchine (x86, Raspberry Pi)
+    report = {'benchmark': name, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'revision': git_revision(), 'machine': machine_info(), 'results': results}
+    if output is None:
+        output = os.path.join(REPO_DIR, 'benchmarks', 'results',
+                              f"{name}-{platform.machine()}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    return output
+
+def format_latency(label, stats, unit='ms'):
+    if not stats:
+        return f"  {label:32} (nessun campione)"
+    return (f"  {label:32} n={stats['count']:<6} p50 {stats['p50']:8.2f} {unit}  p90 {stats['p90']:8.2f} {unit}  "
+            f"p99 {stats['p99']:8.2f} {unit}  max {stats['max']:8.2f} {unit}")
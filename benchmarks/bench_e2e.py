@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""Benchmark end-to-end su modem simulati: latenza RING → decisione → ATA/ATH e chiamate al secondo."""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+from bench_common import percentiles, write_results, format_latency
+from fake_modem import FakeModem, call_script, synthetic_numbers, CID_FORMATS
+
+from blacklist_filter import BlacklistFilter
+from blacklist_watcher import BlacklistWatcher
+from call_logger import CallLogger
+from phone_line import PhoneLine
+
+class TimedCallLogger(CallLogger):
+    # Ricava l'istante della decisione dai tempi della chiamata: le bloccate sono registrate
+    # a fine sequenza, subito dopo l'ultimo passo tracciato
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decisions = {}
+        self._cond = threading.Condition()
+
+    def log_call(self, number=None, action='unknown', reason=None, ring_count=0, notes=None, line=None,
+                 timings=None):
+        now = time.monotonic()
+        marks = [value for value in (timings or {}).values() if value is not None]
+        if marks and timings.get('decision_ms') is not None:
+            now -= (max(marks) - timings['decision_ms']) / 1000
+        with self._cond:
+            self.decisions.setdefault(line, []).append((now, number, action, reason))
+            self._cond.notify_all()
+        return super().log_call(number=number, action=action, reason=reason, ring_count=ring_count,
+                                notes=notes, line=line, timings=timings)
+
+    def wait_decision(self, line, index, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.decisions.get(line, ())) <= index:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self.decisions[line][index]
+
+def wait_idle(line, timeout):
+    deadline = time.monotonic() + timeout
+    while line.call.state != 'idle' or line.action.is_busy():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+def make_blacklist(path, count, seed):
+    rng = random.Random(seed)
+    numbers = sorted({f"+39{rng.choice('03')}{rng.randrange(10 ** 8, 10 ** 9)}" for _ in range(count)})
+    data = {'numbers': numbers, 'prefixes': ['+39899'], 'enabled': True, 'block_anonymous': True}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    return numbers
+
+def drive_line(index, modem, line, call_log, numbers, args, samples, errors):
+    rng = random.Random(args.seed + index)
+    timeout = 30.0 / args.speed + 5.0
+    decided = 0
+    for number in numbers:
+        # Anonimi: metà con Caller ID "privato", metà senza Caller ID (decisi allo scadere di clip_wait_timeout)
+        cid = number is not None or rng.random() < 0.5
+        sent = modem.play(call_script(number, args.format, rings=args.rings, cid=cid))
+        ring_at = sent[0][0]
+        cid_sent = [ts for ts, text in sent if text != 'RING']
+        decision = call_log.wait_decision(line.name, decided, timeout)
+        if decision is None:
+            errors.append(f"{line.name}: nessuna decisione per {number or 'ANONIMO'}")
+            wait_idle(line, timeout)
+            continue
+        decided += 1
+        decided_at, _, action, _ = decision
+        if action == 'blocked':
+            ata = modem.wait_command('ATA', ring_at, timeout)
+            ath = modem.wait_command('ATH', ring_at, timeout) if ata else None
+            if ath is None:
+                errors.append(f"{line.name}: sequenza di blocco incompleta per {number or 'ANONIMO'}")
+            else:
+                samples['decision_to_ata'].append(ata - decided_at)
+                samples['ring_to_ath'].append(ath - ring_at)
+                samples['ath_overshoot'].append(ath - ata - args.block_wait / args.speed)
+        if cid_sent:
+            samples['cid_to_decision'].append(decided_at - cid_sent[-1])
+        else:
+            samples['clip_timeout_overshoot'].append(decided_at - ring_at - args.clip_wait / args.speed)
+        samples['ring_to_decision'].append(decided_at - ring_at)
+        if not wait_idle(line, timeout):
+            errors.append(f"{line.name}: linea non tornata libera")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark end-to-end su modem simulati (pty)')
+    parser.add_argument('--lines', type=int, default=2, help='Linee simulate in parallelo (raffiche)')
+    parser.add_argument('--calls', type=int, default=50, help='Chiamate per linea')
+    parser.add_argument('--speed', type=float, default=20.0,
+                        help='Fattore di velocità: cadenza squilli e timeout del demone divisi per speed')
+    parser.add_argument('--format', choices=CID_FORMATS, default='text', help='Formato del Caller ID')
+    parser.add_argument('--rings', type=int, default=4, help='Squilli per chiamata non bloccata')
+    parser.add_argument('--blacklist-size', type=int, default=10000)
+    parser.add_argument('--ring-timeout', type=float, default=8.0)
+    parser.add_argument('--clip-wait', type=float, default=3.0)
+    parser.add_argument('--block-wait', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help='File JSON dei risultati (default: benchmarks/results/)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    workdir = tempfile.mkdtemp(prefix='callblocker-bench-')
+    config = {'baudrate': 9600, 'ring_timeout': args.ring_timeout / args.speed,
+              'clip_wait_timeout': args.clip_wait / args.speed, 'block_wait_time': args.block_wait / args.speed}
+    modems, lines = [], []
+    try:
+        blacklist_file = os.path.join(workdir, 'blacklist.json')
+        blocked = make_blacklist(blacklist_file, args.blacklist_size, args.seed)
+        blacklist = BlacklistFilter(blacklist_file)
+        watcher = BlacklistWatcher(blacklist)
+        call_log = TimedCallLogger(os.path.join(workdir, 'calls.db'), async_writes=True)
+        for i in range(args.lines):
+            modem = FakeModem(speed=args.speed).start()
+            line = PhoneLine(modem.device, config, blacklist, watcher, call_log)
+            if not line.start():
+                print(f"Errore: linea simulata {modem.device} non avviata", file=sys.stderr)
+                sys.exit(1)
+            modems.append(modem)
+            lines.append(line)
+
+        samples = {'ring_to_decision': [], 'cid_to_decision': [], 'clip_timeout_overshoot': [],
+                   'decision_to_ata': [], 'ring_to_ath': [], 'ath_overshoot': []}
+        errors = []
+        threads = []
+        for i, (modem, line) in enumerate(zip(modems, lines)):
+            numbers = list(synthetic_numbers(args.calls, blocked[:100], seed=args.seed + i))
+            threads.append(threading.Thread(target=drive_line, daemon=True,
+                                            args=(i, modem, line, call_log, numbers, args, samples, errors)))
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+    finally:
+        for line in lines:
+            line.stop()
+        for modem in modems:
+            modem.stop()
+        if lines:
+            call_log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    calls = len(samples['ring_to_decision'])
+    results = {'parameters': vars(args), 'elapsed_s': elapsed, 'calls': calls,
+               'calls_per_s': calls / elapsed if elapsed else 0.0, 'errors': errors,
+               'latency_ms': {key: percentiles(value) for key, value in samples.items()}}
+    print(f"\n=== BENCHMARK END-TO-END ({args.lines} linee, {calls} chiamate, speed {args.speed}) ===\n")
+    for key, stats in results['latency_ms'].items():
+        print(format_latency(key, stats))
+    print(f"\n  Throughput: {results['calls_per_s']:.1f} chiamate/s in {elapsed:.1f}s")
+    for error in errors[:10]:
+        print(f"  ✗ {error}")
+    print(f"\n✓ Risultati salvati in {write_results('e2e', results, args.output)}")
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Microbenchmark del percorso di chiamata: is_blocked, parse_line, log_call, get_stats e caricamento black-list."""
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+from bench_common import percentiles, write_results, format_latency
+import datasets
+from fake_modem import CID_FORMATS
+
+from blacklist_filter import BlacklistFilter
+from blacklist_snapshot import write_snapshot, snapshot_path
+from caller_id import CallerIDParser
+from call_logger import CallLogger
+
+DEFAULT_SIZES = ['1000:10', '100000:1000', '1000000:100000', '10000000:100000']
+QUICK_SIZES = ['1000:10', '10000:100']
+
+def rss_mb():
+    # Memoria residente attuale (Linux); altrove il picco da getrusage
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timed(fn, items):
+    # Latenza per chiamata in secondi (perf_counter_ns: risoluzione adatta ai microsecondi)
+    samples = []
+    clock = time.perf_counter_ns
+    for item in items:
+        start = clock()
+        fn(item)
+        samples.append((clock() - start) / 1e9)
+    return samples
+
+def bench_blacklist(workdir, numbers, prefixes, lookups, seed):
+    result = {'numbers': numbers, 'prefixes': prefixes}
+    base_rss = rss_mb()
+    start = time.perf_counter()
+    path, number_list, prefix_list = datasets.make_blacklist(workdir, numbers, prefixes, seed)
+    result['generate_s'] = time.perf_counter() - start
+    result['json_mb'] = os.path.getsize(path) / 2 ** 20
+    mix = datasets.lookup_mix(lookups, number_list, prefix_list, seed)
+    del number_list, prefix_list
+    gc.collect()
+
+    # Caricamento da JSON
+    rss = rss_mb()
+    start = time.perf_counter()
+    blacklist = BlacklistFilter(path)
+    result['load_json_s'] = time.perf_counter() - start
+    result['rss_json_mb'] = rss_mb() - rss
+    start = time.perf_counter()
+    blacklist.load()
+    result['reload_json_s'] = time.perf_counter() - start
+    result.update(bench_lookups(blacklist, mix, 'json'))
+    del blacklist
+    gc.collect()
+
+    # Snapshot compilato (mmap)
+    with open(path, 'r') as f:
+        data = json.load(f)
+    start = time.perf_counter()
+    write_snapshot(data, snapshot_path(path))
+    result['compile_snapshot_s'] = time.perf_counter() - start
+    del data
+    gc.collect()
+    rss = rss_mb()
+    start = time.perf_counter()
+    blacklist = BlacklistFilter(path)
+    result['load_snapshot_s'] = time.perf_counter() - start
+    result['rss_snapshot_mb'] = rss_mb() - rss
+    start = time.perf_counter()
+    blacklist.load()
+    result['reload_snapshot_s'] = time.perf_counter() - start
+    result.update(bench_lookups(blacklist, mix, 'snapshot'))
+    result['rss_total_mb'] = rss_mb() - base_rss
+    blacklist.snapshot.close()
+    return result
+
+def bench_lookups(blacklist, mix, source):
+    # Senza cache (valutazione completa) e con cache calda (stessi numeri ripetuti)
+    now = time.time()
+    cache_size = blacklist.cache_size
+    blacklist.cache_size = 0
+    cold = timed(lambda n: blacklist.is_blocked(n, now), mix)
+    blacklist.cache_size = cache_size
+    hot_mix = mix[:min(len(mix), cache_size)] * 4
+    for number in hot_mix:
+        blacklist.is_blocked(number, now)
+    hot = timed(lambda n: blacklist.is_blocked(n, now), hot_mix)
+    return {f"is_blocked_{source}_nocache_us": percentiles(cold, scale=1e6),
+            f"is_blocked_{source}_cached_us": percentiles(hot, scale=1e6)}
+
+def bench_parser(calls, seed):
+    results = {}
+    for fmt in CID_FORMATS:
+        lines = datasets.cid_stream(calls, formats=(fmt,), seed=seed)
+        parser = CallerIDParser()
+        results[f"parse_line_{fmt}_us"] = percentiles(timed(parser.parse_line, lines), scale=1e6)
+    return results
+
+def bench_call_log(workdir, years, calls_per_day, writes, seed):
+    results = {}
+    db = os.path.join(workdir, 'calls.db')
+    start = time.perf_counter()
+    results['history_calls'] = datasets.make_call_db(db, years, calls_per_day, seed)
+    results['history_generate_s'] = time.perf_counter() - start
+    results['history_db_mb'] = os.path.getsize(db) / 2 ** 20
+    call_log = CallLogger(db)
+    results['get_stats_ms'] = percentiles(timed(lambda _: call_log.get_stats(), range(50)))
+    results['get_recent_calls_ms'] = percentiles(timed(lambda _: call_log.get_recent_calls(50), range(50)))
+    numbers = datasets.lookup_mix(writes, [], [], seed)
+    # Scrittura sincrona: connessione, INSERT (con trigger degli aggregati) e commit per chiamata
+    results['log_call_sync_ms'] = percentiles(timed(
+        lambda n: call_log.log_call(number=n, action='allowed', reason='not_in_blacklist', line='bench'),
+        numbers[:min(writes, 500)]))
+    # Scrittura asincrona: solo l'accodamento sul percorso di chiamata, più il tempo di svuotamento della coda
+    async_log = CallLogger(db, async_writes=True)
+    results['log_call_async_us'] = percentiles(timed(
+        lambda n: async_log.log_call(number=n, action='blocked', reason='blacklist', line='bench'), numbers),
+        scale=1e6)
+    start = time.perf_counter()
+    async_log.close()
+    results['async_drain_s'] = time.perf_counter() - start
+    return results
+
+def run_worker(spec, args):
+    numbers, _, prefixes = spec.partition(':')
+    workdir = tempfile.mkdtemp(prefix='callblocker-hotpath-')
+    try:
+        return bench_blacklist(workdir, int(numbers), int(prefixes or 0), args.lookups, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmark del percorso di chiamata su dati sintetici')
+    parser.add_argument('--sizes', nargs='*', default=None,
+                        help='Black-list da provare come NUMERI:PREFISSI (default: 10^3, 10^5, 10^6, 10^7 numeri)')
+    parser.add_argument('--quick', action='store_true', help='Solo black-list piccole e storico ridotto')
+    parser.add_argument('--lookups', type=int, default=20000, help='Verifiche is_blocked per black-list')
+    parser.add_argument('--cid-calls', type=int, default=5000, help='Chiamate nel flusso Caller ID')
+    parser.add_argument('--years', type=int, default=3, help='Anni di storico chiamate')
+    parser.add_argument('--calls-per-day', type=int, default=200)
+    parser.add_argument('--writes', type=int, default=5000, help='Chiamate registrate con log_call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help='File JSON dei risultati (default: benchmarks/results/)')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.worker:
+        # Un processo per dimensione: tempi di caricamento e memoria non risentono delle prove precedenti
+        json.dump(run_worker(args.worker, args), sys.stdout)
+        return
+    if args.quick:
+        sizes = args.sizes or QUICK_SIZES
+        args.years, args.calls_per_day = 1, 50
+    else:
+        sizes = args.sizes or DEFAULT_SIZES
+
+    results = {'parameters': vars(args), 'blacklists': []}
+    print("\n=== MICROBENCHMARK PERCORSO DI CHIAMATA ===")
+    for spec in sizes:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', spec,
+                   '--lookups', str(args.lookups), '--seed', str(args.seed)]
+        output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+        item = json.loads(output)
+        results['blacklists'].append(item)
+        print(f"\nBlack-list {item['numbers']} numeri, {item['prefixes']} prefissi "
+              f"(JSON {item['json_mb']:.1f} MB)")
+        print(f"  Caricamento JSON {item['load_json_s']:.3f}s (ricarica {item['reload_json_s']:.3f}s, "
+              f"+{item['rss_json_mb']:.1f} MB), snapshot {item['load_snapshot_s']:.3f}s "
+              f"(ricarica {item['reload_snapshot_s']:.3f}s, +{item['rss_snapshot_mb']:.1f} MB, "
+              f"compilazione {item['compile_snapshot_s']:.3f}s)")
+        for key in sorted(k for k in item if k.startswith('is_blocked')):
+            print(format_latency(key, item[key], 'µs'))
+
+    workdir = tempfile.mkdtemp(prefix='callblocker-hotpath-')
+    try:
+        results['parser'] = bench_parser(args.cid_calls, args.seed)
+        results['call_log'] = bench_call_log(workdir, args.years, args.calls_per_day, args.writes, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print("\nCaller ID")
+    for key, stats in results['parser'].items():
+        print(format_latency(key, stats, 'µs'))
+    log = results['call_log']
+    print(f"\nStorico {log['history_calls']} chiamate ({log['history_db_mb']:.1f} MB)")
+    for key in ('get_stats_ms', 'get_recent_calls_ms', 'log_call_sync_ms'):
+        print(format_latency(key, log[key]))
+    print(format_latency('log_call_async_us', log['log_call_async_us'], 'µs'))
+    print(f"  Svuotamento coda asincrona: {log['async_drain_s']:.3f}s")
+    print(f"\n✓ Risultati salvati in {write_results('hotpath', results, args.output)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Generatori di dati sintetici per i benchmark: black-list grandi, flussi Caller ID, storici di chiamate."""
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime
+
+import bench_common  # noqa: F401  (percorso del repository)
+from fake_modem import cid_lines, CID_FORMATS
+from blacklist_snapshot import write_snapshot, snapshot_path
+from call_logger import CallLogger, INSERT_CALL, TIMING_COLUMNS
+
+MOBILE = 10 ** 9   # numeri "+393" + 9 cifre
+LANDLINE = 10 ** 8  # numeri "+390" + prefisso 2 + 8 cifre (semplificato)
+
+def synthetic_number(rng):
+    if rng.random() < 0.6:
+        return f"+393{rng.randrange(MOBILE):09d}"
+    return f"+390{rng.randrange(10, 100)}{rng.randrange(LANDLINE):08d}"
+
+def blacklist_numbers(count, seed=0):
+    # Numeri canonici distinti: campionamento senza ripetizioni, senza costruire insiemi di stringhe
+    rng = random.Random(seed)
+    mobiles = count * 6 // 10
+    numbers = [f"+393{n:09d}" for n in rng.sample(range(MOBILE), mobiles)]
+    numbers += [f"+390{n // LANDLINE + 10}{n % LANDLINE:08d}" for n in rng.sample(range(90 * LANDLINE), count - mobiles)]
+    numbers.sort()
+    return numbers
+
+def blacklist_prefixes(count, seed=0):
+    # Prefissi di 4-7 cifre dopo +39, distinti
+    rng = random.Random(seed + 1)
+    prefixes = set()
+    while len(prefixes) < count:
+        length = rng.randint(4, 7)
+        prefixes.add(f"+39{rng.choice('03')}{rng.randrange(10 ** (length - 1)):0{length - 1}d}")
+    return sorted(prefixes)
+
+def make_blacklist(directory, numbers=1000, prefixes=10, seed=0, snapshot=False):
+    # Scrive blacklist.json (e a richiesta lo snapshot compilato); restituisce il percorso e le liste
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'blacklist.json')
+    number_list = blacklist_numbers(numbers, seed)
+    prefix_list = blacklist_prefixes(prefixes, seed)
+    data = {'numbers': number_list, 'prefixes': prefix_list, 'enabled': True, 'block_anonymous': True}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    if snapshot:
+        write_snapshot(data, snapshot_path(path))
+    return path, number_list, prefix_list
+
+def lookup_mix(count, numbers, prefixes, seed=0, hit_ratio=0.2, prefix_ratio=0.1):
+    # Numeri da verificare: una quota in black-list, una sotto prefisso bloccato, il resto sconosciuti
+    rng = random.Random(seed + 2)
+    mix = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < hit_ratio and numbers:
+            mix.append(rng.choice(numbers))
+        elif roll < hit_ratio + prefix_ratio and prefixes:
+            prefix = rng.choice(prefixes)
+            mix.append(prefix + ''.join(rng.choice('0123456789') for _ in range(max(1, 12 - len(prefix)))))
+        else:
+            mix.append(synthetic_number(rng))
+    return mix
+
+def cid_stream(calls, formats=CID_FORMATS, anonymous_ratio=0.1, seed=0):
+    # Righe come arrivano dal modem: RING, Caller ID nei vari formati, risposte e rumore
+    rng = random.Random(seed + 3)
+    when = datetime(2024, 1, 1, 12, 0)
+    lines = []
+    for _ in range(calls):
+        number = None if rng.random() < anonymous_ratio else synthetic_number(rng)
+        lines.append('RING')
+        lines.extend(cid_lines(number, rng.choice(formats), when))
+        lines.extend(['RING', 'OK'])
+    return lines
+
+def make_call_db(path, years=3, calls_per_day=50, seed=0, batch=10000):
+    # Storico sintetico su più anni con lo schema e i trigger del demone (aggregati compresi)
+    if os.path.exists(path):
+        os.unlink(path)
+    CallLogger(path)
+    rng = random.Random(seed + 4)
+    callers = [synthetic_number(rng) for _ in range(max(100, calls_per_day * 20))]
+    end = int(time.time())
+    start = end - years * 365 * 86400
+    total = years * 365 * calls_per_day
+    step = (end - start) / total
+    conn = sqlite3.connect(path)
+    try:
+        rows = []
+        for i in range(total):
+            ts = int(start + i * step)
+            blocked = rng.random() < 0.3
+            number = None if rng.random() < 0.05 else rng.choice(callers)
+            rows.append((datetime.fromtimestamp(ts).isoformat(), ts, number, 'blocked' if blocked else 'allowed',
+                         'blacklist' if blocked else 'not_in_blacklist', rng.randint(1, 4), None, 'ttyACM0',
+                         *([None] * len(TIMING_COLUMNS))))
+            if len(rows) >= batch:
+                with conn:
+                    conn.executemany(INSERT_CALL, rows)
+                rows = []
+        if rows:
+            with conn:
+                conn.executemany(INSERT_CALL, rows)
+    finally:
+        conn.close()
+    return total
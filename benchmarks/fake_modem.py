@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Modem simulato su pseudo-terminale: risponde ai comandi AT e riproduce traffico RING/Caller ID."""
+import argparse
+import os
+import pty
+import random
+import select
+import sys
+import threading
+import time
+import tty
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+CID_FORMATS = ('text', 'clip', 'mdmf')
+RING_INTERVAL = 4.0   # cadenza degli squilli (secondi reali, divisi per speed)
+CID_DELAY = 0.5       # Caller ID dopo il primo RING
+
+def mdmf_frame(number, when=None):
+    # Frame MDMF come da AT+VCID=2: tipo 0x80, data/ora, numero (o motivo di assenza), checksum
+    when = when or datetime.now()
+    params = bytes([0x01, 8]) + when.strftime('%m%d%H%M').encode('ascii')
+    if number:
+        params += bytes([0x02, len(number)]) + number.encode('ascii')
+    else:
+        params += bytes([0x04, 1]) + b'P'
+    frame = bytes([0x80, len(params)]) + params
+    return (frame + bytes([-sum(frame) & 0xFF])).hex().upper()
+
+def cid_lines(number, fmt='text', when=None):
+    # Righe che il modem invia per il Caller ID; number None = chiamante anonimo
+    when = when or datetime.now()
+    if fmt == 'clip':
+        if number:
+            return [f'+CLIP: "{number}",145,"",,"",0']
+        return ['+CLIP: "",128,"",,"",1']
+    if fmt == 'mdmf':
+        return [mdmf_frame(number, when)]
+    return [f"DATE = {when.strftime('%m%d')}", f"TIME = {when.strftime('%H%M')}", f"NMBR = {number or 'P'}"]
+
+def call_script(number, fmt='text', rings=4, cid=True):
+    # Una chiamata come sequenza (offset in secondi, riga); senza cid il modem non riceve il Caller ID
+    script = [(0.0, 'RING')]
+    if cid:
+        script += [(CID_DELAY, line) for line in cid_lines(number, fmt)]
+    script += [(i * RING_INTERVAL, 'RING') for i in range(1, rings)]
+    return script
+
+def load_script(path):
+    # Registrazione: una riga per evento "offset_secondi testo"; '#' per i commenti
+    script = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            offset, _, text = line.strip().partition(' ')
+            script.append((float(offset), text.strip()))
+    script.sort(key=lambda item: item[0])
+    return script
+
+def synthetic_numbers(count, blocked, block_ratio=0.3, anonymous_ratio=0.1, seed=None):
+    # Sequenza di chiamanti: una quota dalla black-list, una anonima, il resto numeri casuali
+    rng = random.Random(seed)
+    blocked = list(blocked)
+    for _ in range(count):
+        roll = rng.random()
+        if roll < anonymous_ratio:
+            yield None
+        elif roll < anonymous_ratio + block_ratio and blocked:
+            yield rng.choice(blocked)
+        else:
+            yield f"+39{rng.choice('03')}{rng.randrange(10 ** 8, 10 ** 9)}"
+
+class FakeModem:
+    def __init__(self, link=None, speed=1.0):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.device = os.ttyname(self.slave)
+        self.link = link
+        if link:
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(self.device, link)
+        self.speed = speed
+        self.off_hook = False
+        # Chiamata in riproduzione risposta (ATA): resta vero anche dopo l'ATH
+        self.answered = False
+        # Comandi ricevuti: (istante monotono, comando)
+        self.commands = []
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    @property
+    def path(self):
+        return self.link or self.device
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._reader_loop, name=f"fake-modem-{self.device}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        if self.link and os.path.islink(self.link):
+            os.unlink(self.link)
+
+    def _reader_loop(self):
+        buffer = b''
+        while self._running:
+            try:
+                readable, _, _ = select.select([self.master], [], [], 0.2)
+                if not readable:
+                    continue
+                buffer += os.read(self.master, 4096)
+            except OSError:
+                return
+            while b'\r' in buffer:
+                raw, buffer = buffer.split(b'\r', 1)
+                command = raw.strip().decode('ascii', errors='ignore')
+                if command:
+                    self._handle_command(command)
+
+    def _handle_command(self, command):
+        now = time.monotonic()
+        upper = command.upper()
+        if upper == 'ATA':
+            self.off_hook = True
+            self.answered = True
+        elif upper.startswith('ATH'):
+            self.off_hook = False
+        with self._cond:
+            self.commands.append((now, upper))
+            self._cond.notify_all()
+        logger.debug(f"{self.device} ← {command}")
+        self.write(['OK'] if upper.startswith('AT') else ['ERROR'])
+
+    def write(self, lines):
+        data = ''.join(f"\r\n{line}\r\n" for line in lines).encode('ascii')
+        with self._write_lock:
+            os.write(self.master, data)
+        return time.monotonic()
+
+    def wait_command(self, command, since, timeout):
+        # Istante del primo comando ricevuto dopo since, None allo scadere di timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                for ts, received in self.commands:
+                    if ts >= since and received.startswith(command):
+                        return ts
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def play(self, script, stop_when_answered=True):
+        # Riproduce lo script in tempo reale diviso per speed; si ferma se la chiamata viene risposta (ATA)
+        # Restituisce le righe inviate come (istante monotono, riga)
+        self.answered = False
+        start = time.monotonic()
+        sent = []
+        for offset, line in script:
+            delay = start + offset / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if stop_when_answered and self.answered:
+                break
+            sent.append((self.write([line]), line))
+        return sent
+
+def main():
+    parser = argparse.ArgumentParser(description='Modem simulato su pty per prove senza hardware')
+    parser.add_argument('--link', default='/tmp/ttyFAKE', help='Prefisso dei link ai pty (es. /tmp/ttyFAKE0)')
+    parser.add_argument('--lines', type=int, default=1, help='Numero di linee (modem) simulate')
+    parser.add_argument('--speed', type=float, default=1.0, help='Fattore di velocità della riproduzione')
+    parser.add_argument('--replay', help='Registrazione da riprodurre su ogni linea ("offset testo" per riga)')
+    parser.add_argument('--calls', type=int, default=10, help='Chiamate sintetiche per linea (senza --replay)')
+    parser.add_argument('--interval', type=float, default=30.0, help='Secondi tra una chiamata e la successiva')
+    parser.add_argument('--format', choices=CID_FORMATS, default='text', help='Formato del Caller ID')
+    parser.add_argument('--blocked', nargs='*', default=['+390212345678'], help='Numeri da far chiamare come bloccati')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(asctime)s %(message)s')
+
+    modems = [FakeModem(f"{args.link}{i}", args.speed).start() for i in range(args.lines)]
+    for modem in modems:
+        print(f"✓ Modem simulato su {modem.path} → {modem.device}")
+    print("Avvia il demone con device/devices puntati a questi percorsi, poi premi Invio (Ctrl+C per uscire)")
+
+    def drive(index, modem):
+        if args.replay:
+            modem.play(load_script(args.replay), stop_when_answered=False)
+            return
+        numbers = synthetic_numbers(args.calls, args.blocked, seed=None if args.seed is None else args.seed + index)
+        for number in numbers:
+            started = time.monotonic()
+            modem.play(call_script(number, args.format))
+            answered = modem.wait_command('ATA', started, 0) is not None
+            logger.info(f"{modem.path}: chiamata da {number or 'ANONIMO'} {'bloccata' if answered else 'terminata'}")
+            time.sleep(max(0.0, args.interval / args.speed - (time.monotonic() - started)))
+
+    try:
+        sys.stdin.readline()
+        threads = [threading.Thread(target=drive, args=(i, m), daemon=True) for i, m in enumerate(modems)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for modem in modems:
+            modem.stop()
+
+if __name__ == '__main__':
+    main()
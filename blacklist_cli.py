@@ -1,160 +1,498 @@
 #!/usr/bin/env python3
 """CLI Tool per gestione black-list."""
 import json
+import os
+import re
 import sys
+import time
 import argparse
-import sqlite3
+import csv
+from itertools import islice
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from blacklist_snapshot import write_snapshot, snapshot_path, read_meta
+from call_logger import CallLogger
+from blacklist_filter import BlacklistFilter
+from blacklist_journal import (journal_path, journal_lock, append_ops, journal_span,
+                               read_journal, reset_journal, fold_journal, inherit_owner)
+from number_normalizer import DEFAULT_COUNTRY_CODE, normalizer_for
+from rule_engine import compile_rule, DEFAULT_RULE_PRIORITY
+from control_socket import SOCKET_PATH, request
+from blacklist_sources import (sources_dir, source_path, list_sources, read_source, load_sources,
+                               write_source, detect_format, iter_feed)
 
 BLACKLIST_FILE = '/var/lib/callblocker/blacklist.json'
 LOG_DB = '/var/lib/callblocker/calls.db'
+ARCHIVE_DIR = '/var/lib/callblocker/archive'
+RETENTION_DAYS = 365
+JOURNAL_COMPACT_THRESHOLD = 1000
+EXPORT_FIELDS = ['id', 'timestamp', 'ts', 'number', 'action', 'reason', 'ring_count', 'line', 'notes',
+                 'cid_ms', 'decision_ms', 'ata_sent_ms', 'ata_ok_ms', 'ath_sent_ms', 'ath_ok_ms']
+CANONICAL_NUMBER = re.compile(r'^\+\d{3,}$')
+CANONICAL_PREFIX = re.compile(r'^\+\d+$')
 
 def load_blacklist():
+    # Vista canonica: le varianti dello stesso numero (+39..., 0039..., 0...) sono un'unica voce
+    bl = load_base_blacklist()
+    normalizer = normalizer_for(bl)
+    entries, _, _ = read_journal(journal_path(BLACKLIST_FILE))
+    return fold_journal(normalizer.normalize_blacklist(bl), entries, normalizer.normalize_entry)
+
+def load_base_blacklist():
     try:
         with open(BLACKLIST_FILE, 'r') as f:
             return json.load(f)
     except FileNotFoundError:
-        return {'enabled': True, 'block_anonymous': False, 'numbers': [], 'prefixes': []}
+        return {'enabled': True, 'block_anonymous': False, 'country_code': DEFAULT_COUNTRY_CODE,
+                'numbers': [], 'prefixes': [], 'ranges': []}
     except Exception as e:
         print(f"Errore caricamento: {e}", file=sys.stderr)
         sys.exit(1)
 
+def blacklist_settings():
+    # Impostazioni (country_code, journal_seq) dai metadati dello snapshot: le modifiche singole
+    # non pagano il parse completo di blacklist.json, necessario solo se lo snapshot manca o è vecchio
+    snapshot = snapshot_path(BLACKLIST_FILE)
+    try:
+        if os.path.getmtime(snapshot) >= os.path.getmtime(BLACKLIST_FILE):
+            return read_meta(snapshot)
+    except (OSError, ValueError):
+        pass
+    return load_base_blacklist()
+
 def save_blacklist(data):
     try:
         Path(BLACKLIST_FILE).parent.mkdir(parents=True, exist_ok=True)
-        with open(BLACKLIST_FILE, 'w') as f:
+        numbers, prefixes = load_sources(sources_dir(BLACKLIST_FILE))
+        # Un'esclusione serve solo finché la voce compare in una fonte importata
+        for kind, source_values in (('excluded_numbers', numbers), ('excluded_prefixes', prefixes)):
+            if kind in data:
+                data[kind] = sorted(v for v in data[kind] if v in source_values)
+        tmp_file = BLACKLIST_FILE + '.tmp'
+        with open(tmp_file, 'w') as f:
             json.dump(data, f, indent=2)
+        inherit_owner(tmp_file)
+        os.replace(tmp_file, BLACKLIST_FILE)
+        write_snapshot(data, snapshot_path(BLACKLIST_FILE), numbers, prefixes)
         print("✓ Black-list salvata")
     except Exception as e:
         print(f"Errore salvataggio: {e}", file=sys.stderr)
         sys.exit(1)
 
-def add_number(number):
-    bl = load_blacklist()
-    if number in bl['numbers']:
-        print(f"Numero {number} già presente")
+def journal_ops(*ops):
+    # Ogni modifica è un'append O(1) al journal; il demone applica solo le voci nuove
+    path = journal_path(BLACKLIST_FILE)
+    try:
+        Path(BLACKLIST_FILE).parent.mkdir(parents=True, exist_ok=True)
+        base_seq = 0 if os.path.exists(path) else blacklist_settings().get('journal_seq', 0)
+        append_ops(path, ops, base_seq)
+        span = journal_span(path)
+    except Exception as e:
+        print(f"Errore scrittura journal: {e}", file=sys.stderr)
+        sys.exit(1)
+    if span and span[1] - span[0] >= JOURNAL_COMPACT_THRESHOLD:
+        compact_blacklist()
+
+def submit_ops(*ops):
+    # Con il demone attivo la modifica vale subito in memoria (e lui la salva nel journal);
+    # altrimenti si scrive direttamente il journal
+    response = request('apply', SOCKET_PATH, ops=list(ops))
+    if response is None:
+        journal_ops(*ops)
         return
-    bl['numbers'].append(number)
-    save_blacklist(bl)
+    if not response.get('ok'):
+        print(f"Errore dal demone: {response.get('error')}", file=sys.stderr)
+        sys.exit(1)
+
+def compact_blacklist():
+    path = journal_path(BLACKLIST_FILE)
+    with journal_lock(path):
+        bl = load_blacklist()
+        save_blacklist(bl)
+        reset_journal(path, bl.get('journal_seq', 0))
+    print(f"✓ Journal compattato (seq {bl.get('journal_seq', 0)}): "
+          f"{len(bl['numbers'])} numeri, {len(bl['prefixes'])} prefissi, {len(bl.get('ranges', []))} intervalli")
+
+def canonical(kind, value):
+    try:
+        return normalizer_for(blacklist_settings()).normalize_entry(kind, value)
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def add_number(number):
+    number = canonical('numbers', number)
+    submit_ops({'op': 'add', 'kind': 'numbers', 'value': number})
     print(f"✓ Aggiunto: {number}")
 
 def remove_number(number):
-    bl = load_blacklist()
-    if number not in bl['numbers']:
-        print(f"Numero {number} non trovato")
-        return
-    bl['numbers'].remove(number)
-    save_blacklist(bl)
+    number = canonical('numbers', number)
+    submit_ops({'op': 'remove', 'kind': 'numbers', 'value': number})
     print(f"✓ Rimosso: {number}")
 
 def add_prefix(prefix):
-    bl = load_blacklist()
-    if prefix in bl['prefixes']:
-        print(f"Prefisso {prefix} già presente")
-        return
-    bl['prefixes'].append(prefix)
-    save_blacklist(bl)
+    prefix = canonical('prefixes', prefix)
+    submit_ops({'op': 'add', 'kind': 'prefixes', 'value': prefix})
     print(f"✓ Aggiunto prefisso: {prefix}")
 
 def remove_prefix(prefix):
-    bl = load_blacklist()
-    if prefix not in bl['prefixes']:
-        print(f"Prefisso {prefix} non trovato")
-        return
-    bl['prefixes'].remove(prefix)
-    save_blacklist(bl)
+    prefix = canonical('prefixes', prefix)
+    submit_ops({'op': 'remove', 'kind': 'prefixes', 'value': prefix})
     print(f"✓ Rimosso prefisso: {prefix}")
 
+def range_value(start, end):
+    start, end = canonical('ranges', [start, end])
+    if len(start) != len(end) or not start[1:].isdigit() or not end[1:].isdigit():
+        print(f"Errore: estremi dell'intervallo non validi o di lunghezza diversa: {start} {end}", file=sys.stderr)
+        sys.exit(1)
+    if start > end:
+        start, end = end, start
+    return [start, end]
+
+def add_range(start, end):
+    value = range_value(start, end)
+    submit_ops({'op': 'add', 'kind': 'ranges', 'value': value})
+    print(f"✓ Aggiunto intervallo: {value[0]} - {value[1]}")
+
+def remove_range(start, end):
+    value = range_value(start, end)
+    submit_ops({'op': 'remove', 'kind': 'ranges', 'value': value})
+    print(f"✓ Rimosso intervallo: {value[0]} - {value[1]}")
+
+def allow_number(number):
+    number = canonical('allow_numbers', number)
+    submit_ops({'op': 'add', 'kind': 'allow_numbers', 'value': number})
+    print(f"✓ Numero sempre permesso: {number}")
+
+def remove_allow_number(number):
+    number = canonical('allow_numbers', number)
+    submit_ops({'op': 'remove', 'kind': 'allow_numbers', 'value': number})
+    print(f"✓ Rimossa eccezione: {number}")
+
+def allow_prefix(prefix):
+    prefix = canonical('allow_prefixes', prefix)
+    submit_ops({'op': 'add', 'kind': 'allow_prefixes', 'value': prefix})
+    print(f"✓ Prefisso sempre permesso: {prefix}")
+
+def remove_allow_prefix(prefix):
+    prefix = canonical('allow_prefixes', prefix)
+    submit_ops({'op': 'remove', 'kind': 'allow_prefixes', 'value': prefix})
+    print(f"✓ Rimossa eccezione prefisso: {prefix}")
+
+def add_rule(rule_id, action, prefix=None, number=None, priority=DEFAULT_RULE_PRIORITY, days=None, hours=None):
+    rule = {'id': rule_id, 'action': action, 'priority': priority}
+    if number is not None:
+        rule['number'] = number
+    else:
+        rule['prefix'] = prefix or ''
+    if days:
+        rule['days'] = days
+    if hours:
+        rule['hours'] = hours
+    rule = canonical('rules', rule)
+    try:
+        compile_rule(rule)
+    except ValueError as e:
+        print(f"Errore: regola non valida: {e}", file=sys.stderr)
+        sys.exit(1)
+    submit_ops({'op': 'add', 'kind': 'rules', 'value': rule})
+    print(f"✓ Regola {rule_id} salvata: {describe_rule(rule)}")
+
+def remove_rule(rule_id):
+    submit_ops({'op': 'remove', 'kind': 'rules', 'value': {'id': rule_id}})
+    print(f"✓ Regola rimossa: {rule_id}")
+
+def describe_rule(rule):
+    target = f"numero {rule['number']}" if 'number' in rule else f"prefisso {rule.get('prefix') or '*'}"
+    when = ''
+    if rule.get('days'):
+        when += f" giorni {rule['days']}"
+    if rule.get('hours'):
+        when += f" ore {rule['hours']}"
+    return f"{rule.get('action', 'block')} {target} (priorità {rule.get('priority', DEFAULT_RULE_PRIORITY)}){when}"
+
+def import_feed(filename, source, fmt=None, column=0, replace=False):
+    # Un solo passaggio in streaming: normalizzazione e deduplica su set, poi scrittura atomica
+    # della fonte e rigenerazione dello snapshot (il demone ricarica da solo)
+    started = time.monotonic()
+    normalizer = normalizer_for(blacklist_settings())
+    try:
+        path = source_path(sources_dir(BLACKLIST_FILE), source)
+    except ValueError as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        sys.exit(1)
+    numbers, prefixes = set(), set()
+    if not replace and os.path.exists(path):
+        numbers, prefixes = read_source(path)
+    before = len(numbers) + len(prefixes)
+    read = skipped = 0
+    fmt = fmt or (detect_format(filename) if filename != '-' else 'txt')
+    canonical, canonical_prefix = normalizer.canonical, normalizer.canonical_prefix
+    add_number, add_prefix = numbers.add, prefixes.add
+    try:
+        stream = sys.stdin if filename == '-' else open(filename, 'r', newline='', encoding='utf-8', errors='replace')
+        with stream:
+            for value, is_prefix in iter_feed(stream, fmt, column):
+                read += 1
+                if is_prefix:
+                    try:
+                        value = canonical_prefix(value)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if CANONICAL_PREFIX.match(value):
+                        add_prefix(value)
+                        continue
+                else:
+                    value = canonical(value)
+                    if CANONICAL_NUMBER.match(value):
+                        add_number(value)
+                        continue
+                skipped += 1
+    except (OSError, ValueError) as e:
+        print(f"Errore lettura {filename}: {e}", file=sys.stderr)
+        sys.exit(1)
+    write_source(path, numbers, prefixes)
+    print(f"✓ Fonte {source}: {read} righe lette, {skipped} scartate, "
+          f"{len(numbers)} numeri e {len(prefixes)} prefissi ({len(numbers) + len(prefixes) - before:+d})")
+    compact_blacklist()
+    print(f"✓ Import completato in {time.monotonic() - started:.1f}s")
+
+def remove_source(source):
+    try:
+        path = source_path(sources_dir(BLACKLIST_FILE), source)
+        os.unlink(path)
+    except (ValueError, FileNotFoundError):
+        print(f"Errore: fonte non trovata: {source}", file=sys.stderr)
+        sys.exit(1)
+    print(f"✓ Fonte rimossa: {source}")
+    compact_blacklist()
+
+def show_sources():
+    directory = sources_dir(BLACKLIST_FILE)
+    names = list_sources(directory)
+    print(f"\nFonti importate ({len(names)}):")
+    for name in names:
+        path = source_path(directory, name)
+        numbers, prefixes = read_source(path)
+        updated = datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y-%m-%d %H:%M')
+        print(f"  - {name:20} {len(numbers):8} numeri {len(prefixes):6} prefissi  (aggiornata {updated})")
+
 def list_blacklist():
     bl = load_blacklist()
     print("\n=== BLACK-LIST ===")
     print(f"Stato: {'ATTIVA' if bl['enabled'] else 'DISATTIVA'}")
     print(f"Blocco anonimi: {'SÌ' if bl['block_anonymous'] else 'NO'}")
+    print(f"Prefisso paese: +{bl.get('country_code', DEFAULT_COUNTRY_CODE)}")
     print(f"\nNumeri bloccati ({len(bl['numbers'])}):")
     for num in sorted(bl['numbers']):
         print(f"  - {num}")
     print(f"\nPrefissi bloccati ({len(bl['prefixes'])}):")
     for pref in sorted(bl['prefixes']):
         print(f"  - {pref}")
+    ranges = bl.get('ranges', [])
+    print(f"\nIntervalli bloccati ({len(ranges)}):")
+    for start, end in sorted(ranges):
+        print(f"  - {start} - {end}")
+    allowed = sorted(bl.get('allow_numbers', [])) + [f"{p}*" for p in sorted(bl.get('allow_prefixes', []))]
+    print(f"\nEccezioni sempre permesse ({len(allowed)}):")
+    for entry in allowed:
+        print(f"  - {entry}")
+    excluded = sorted(bl.get('excluded_numbers', [])) + [f"{p}*" for p in sorted(bl.get('excluded_prefixes', []))]
+    if excluded:
+        print(f"\nVoci delle fonti rimosse a mano ({len(excluded)}):")
+        for entry in excluded:
+            print(f"  - {entry}")
+    rules = bl.get('rules', [])
+    print(f"\nRegole ({len(rules)}):")
+    for rule in sorted(rules, key=lambda r: -r.get('priority', DEFAULT_RULE_PRIORITY)):
+        print(f"  - {rule['id']}: {describe_rule(rule)}")
+    show_sources()
 
 def enable_filter(enable=True):
-    bl = load_blacklist()
-    bl['enabled'] = enable
-    save_blacklist(bl)
+    submit_ops({'op': 'set', 'key': 'enabled', 'value': enable})
     print(f"✓ Filtro {'abilitato' if enable else 'disabilitato'}")
 
 def toggle_anonymous(block=True):
-    bl = load_blacklist()
-    bl['block_anonymous'] = block
-    save_blacklist(bl)
+    submit_ops({'op': 'set', 'key': 'block_anonymous', 'value': block})
     print(f"✓ Chiamate anonime: {'bloccate' if block else 'permesse'}")
 
-def show_log(limit=20, blocked_only=False):
+def open_call_log(read_only=True):
+    # Le interrogazioni non toccano lo schema: migrazioni e ricostruzioni restano al demone
+    # e ai comandi che scrivono (archive, rebuild-stats)
+    return CallLogger(LOG_DB, archive_dir=ARCHIVE_DIR, read_only=read_only)
+
+def print_call(row):
+    # ts manca solo per righe storiche con timestamp illeggibile: si mostra il testo originale
+    when = (datetime.fromtimestamp(row['ts']).strftime('%Y-%m-%d %H:%M:%S') if row['ts'] is not None
+            else f"{row.get('timestamp') or '?':19.19}")
+    number = row['number'] or 'ANONIMO'
+    action = row['action'].upper()
+    reason = row['reason'] or '-'
+    symbol = '🚫' if action == 'BLOCKED' else '✓'
+    line = row.get('line') or '-'
+    timing = f" ({row['decision_ms']:.0f} ms)" if row.get('decision_ms') is not None else ''
+    print(f"{symbol} {when} | {line:8} | {number:20} | {action:10} | {reason}{timing}")
+
+def parse_time(value):
+    # Data/ora ISO (2024-05-01, 2024-05-01T09:30) oppure epoch
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
     try:
-        conn = sqlite3.connect(LOG_DB)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        query = 'SELECT * FROM calls'
-        if blocked_only:
-            query += " WHERE action = 'blocked'"
-        query += ' ORDER BY timestamp DESC LIMIT ?'
-        cursor.execute(query, (limit,))
-        rows = cursor.fetchall()
-        conn.close()
-        if not rows:
-            print("Nessuna chiamata registrata")
-            return
-        print(f"\n=== ULTIME {len(rows)} CHIAMATE ===\n")
-        for row in rows:
-            ts = datetime.fromisoformat(row['timestamp'])
-            number = row['number'] or 'ANONIMO'
-            action = row['action'].upper()
-            reason = row['reason'] or '-'
-            symbol = '🚫' if action == 'BLOCKED' else '✓'
-            print(f"{symbol} {ts.strftime('%Y-%m-%d %H:%M:%S')} | {number:20} | {action:10} | {reason}")
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        print(f"Errore: data non valida: {value}", file=sys.stderr)
+        sys.exit(1)
+
+def call_filters(args):
+    return {'number': args.number, 'action': args.action, 'reason': args.reason,
+            'since': parse_time(args.since), 'until': parse_time(args.until), 'include_archive': args.archive}
+
+def show_log(limit=20, blocked_only=False, include_archive=False):
+    search_log(limit=limit, action='blocked' if blocked_only else None, include_archive=include_archive)
+
+def search_log(limit=20, **filters):
+    if not os.path.exists(LOG_DB):
+        print("Nessuna chiamata registrata")
+        return
+    try:
+        rows = list(islice(open_call_log().iter_calls(page_size=min(limit, 1000), **filters), limit))
     except Exception as e:
         print(f"Errore lettura log: {e}", file=sys.stderr)
+        return
+    if not rows:
+        print("Nessuna chiamata registrata")
+        return
+    print(f"\n=== ULTIME {len(rows)} CHIAMATE ===\n")
+    for row in rows:
+        print_call(row)
+
+def export_log(output='-', fmt='csv', **filters):
+    # In streaming dal generatore: memoria costante sul database qualunque sia la dimensione
+    # dello storico; con --archive si aggiunge al più un mese archiviato (filtrato) alla volta
+    if not os.path.exists(LOG_DB):
+        print("Nessuna chiamata registrata", file=sys.stderr)
+        return
+    count = 0
+    try:
+        stream = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+        with stream:
+            rows = open_call_log().iter_calls(newest_first=False, **filters)
+            if fmt == 'jsonl':
+                for row in rows:
+                    stream.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    count += 1
+            else:
+                writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+    except Exception as e:
+        print(f"Errore esportazione: {e}", file=sys.stderr)
+        sys.exit(1)
+    if output != '-':
+        print(f"✓ Esportate {count} chiamate in {output}")
 
 def show_stats():
+    if not os.path.exists(LOG_DB):
+        print("Nessuna chiamata registrata")
+        return
+    stats = open_call_log().get_stats()
+    if not stats:
+        print("Errore calcolo statistiche", file=sys.stderr)
+        return
+    total = stats['total_calls']
+    blocked = stats['blocked_calls']
+    print("\n=== STATISTICHE ===\n")
+    print(f"Totale chiamate:     {total}")
+    print(f"  - Bloccate:        {blocked} ({blocked/total*100 if total > 0 else 0:.1f}%)")
+    print(f"  - Permesse:        {total - blocked}")
+    print(f"\nOggi:")
+    print(f"  - Totale:          {stats['today_calls']}")
+    print(f"  - Bloccate:        {stats['today_blocked']}")
+    print(f"\nUltimi 7 giorni:")
+    print(f"  - Totale:          {stats['week_calls']}")
+    print(f"  - Bloccate:        {stats['week_blocked']}")
+    if stats['top_blocked']:
+        print(f"\nTop 5 numeri bloccati:")
+        for num, count in stats['top_blocked']:
+            print(f"  - {num:20} ({count} volte)")
+    live = request('stats', SOCKET_PATH)
+    if live and live.get('ok'):
+        cache = live['cache']
+        print(f"\nDemone:")
+        print(f"  - Cache decisioni:  {cache['hits']} hit / {cache['misses']} miss ({cache['hit_rate']:.0%})")
+        if 'repeat' in live:
+            print(f"  - Blocchi automatici attivi: {live['repeat']['auto_blocked']}")
+
+def check_number(number):
+    response = request('check', SOCKET_PATH, number=number)
+    if response is None:
+        # Demone non attivo: stessa valutazione sul contenuto attuale dei file.
+        # Senza file non si valuta nulla: BlacklistFilter creerebbe una black-list vuota
+        if not os.path.exists(BLACKLIST_FILE):
+            print(f"Nessuna black-list ({BLACKLIST_FILE}) e demone non in esecuzione", file=sys.stderr)
+            sys.exit(1)
+        blacklist = BlacklistFilter(BLACKLIST_FILE)
+        blocked, reason = blacklist.check(number)
+        response = {'ok': True, 'canonical': blacklist.canonical(number), 'blocked': blocked, 'reason': reason}
+        source = 'file'
+    else:
+        source = 'demone'
+    if not response.get('ok'):
+        print(f"Errore dal demone: {response.get('error')}", file=sys.stderr)
+        sys.exit(1)
+    verdict = '🚫 BLOCCATO' if response['blocked'] else '✓ PERMESSO'
+    print(f"{verdict}: {response['canonical'] or 'ANONIMO'} ({response['reason']}) [{source}]")
+
+def show_status():
+    response = request('status', SOCKET_PATH)
+    if response is None:
+        print("Demone non in esecuzione", file=sys.stderr)
+        sys.exit(1)
+    bl = response['blacklist']
+    print("\n=== STATO DEMONE ===\n")
+    print(f"PID {response['pid']}, attivo da {int(response['uptime'] // 60)} minuti")
+    print(f"Black-list ({bl['source']}, seq {bl['journal_seq']}): {'ATTIVA' if bl['enabled'] else 'DISATTIVA'}, "
+          f"{bl['numbers']} numeri, {bl['prefixes']} prefissi, {bl['ranges']} intervalli, "
+          f"{bl['allow']} eccezioni, {bl['rules']} regole")
+    print("\nLinee:")
+    for line in response['lines']:
+        busy = line['state'] != 'idle'
+        state = 'in chiamata' if busy else 'libera'
+        if busy:
+            state += (f" ({line['state']}, {line['number'] or 'numero non ricevuto'}, squilli {line['ring_count']}, "
+                      f"{line['action']}, {line['elapsed']:.1f}s)")
+        print(f"  - {line['name']:10} {'OK' if line['running'] else 'FERMA':6} {state}")
+
+def show_metrics():
+    response = request('metrics', SOCKET_PATH)
+    if response is None:
+        print("Demone non in esecuzione", file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(response['text'])
+
+def archive_log(days=RETENTION_DAYS):
+    if not os.path.exists(LOG_DB):
+        print("Nessuna chiamata registrata")
+        return
+    total = open_call_log(read_only=False).archive(days)
+    print(f"✓ Archiviate {total} chiamate più vecchie di {days} giorni in {ARCHIVE_DIR}")
+
+def rebuild_stats():
+    if not os.path.exists(LOG_DB):
+        print("Nessuna chiamata registrata")
+        return
     try:
-        conn = sqlite3.connect(LOG_DB)
-        cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM calls')
-        total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM calls WHERE action = 'blocked'")
-        blocked = cursor.fetchone()[0]
-        today = datetime.now().date().isoformat()
-        cursor.execute('SELECT COUNT(*) FROM calls WHERE date(timestamp) = ?', (today,))
-        today_total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM calls WHERE date(timestamp) = ? AND action = 'blocked'", (today,))
-        today_blocked = cursor.fetchone()[0]
-        week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
-        cursor.execute('SELECT COUNT(*) FROM calls WHERE date(timestamp) >= ?', (week_ago,))
-        week_total = cursor.fetchone()[0]
-        cursor.execute("SELECT COUNT(*) FROM calls WHERE date(timestamp) >= ? AND action = 'blocked'", (week_ago,))
-        week_blocked = cursor.fetchone()[0]
-        cursor.execute('''SELECT number, COUNT(*) as count FROM calls 
-                         WHERE action = 'blocked' AND number IS NOT NULL
-                         GROUP BY number ORDER BY count DESC LIMIT 5''')
-        top_blocked = cursor.fetchall()
-        conn.close()
-        print("\n=== STATISTICHE ===\n")
-        print(f"Totale chiamate:     {total}")
-        print(f"  - Bloccate:        {blocked} ({blocked/total*100 if total > 0 else 0:.1f}%)")
-        print(f"  - Permesse:        {total - blocked}")
-        print(f"\nOggi:")
-        print(f"  - Totale:          {today_total}")
-        print(f"  - Bloccate:        {today_blocked}")
-        print(f"\nUltimi 7 giorni:")
-        print(f"  - Totale:          {week_total}")
-        print(f"  - Bloccate:        {week_blocked}")
-        if top_blocked:
-            print(f"\nTop 5 numeri bloccati:")
-            for num, count in top_blocked:
-                print(f"  - {num:20} ({count} volte)")
+        total = open_call_log(read_only=False).rebuild_rollups()
     except Exception as e:
-        print(f"Errore calcolo statistiche: {e}", file=sys.stderr)
+        print(f"Errore ricostruzione statistiche: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"✓ Statistiche ricostruite ({total} chiamate)")
 
 def main():
     parser = argparse.ArgumentParser(description='Gestione black-list Call Blocker')
@@ -167,7 +505,44 @@ def main():
     add_prefix_parser.add_argument('prefix', help='Prefisso da aggiungere')
     remove_prefix_parser = subparsers.add_parser('remove-prefix', help='Rimuovi prefisso')
     remove_prefix_parser.add_argument('prefix', help='Prefisso da rimuovere')
+    add_range_parser = subparsers.add_parser('add-range', help='Aggiungi intervallo di numeri')
+    add_range_parser.add_argument('start', help='Primo numero dell\'intervallo')
+    add_range_parser.add_argument('end', help='Ultimo numero dell\'intervallo')
+    remove_range_parser = subparsers.add_parser('remove-range', help='Rimuovi intervallo di numeri')
+    remove_range_parser.add_argument('start', help='Primo numero dell\'intervallo')
+    remove_range_parser.add_argument('end', help='Ultimo numero dell\'intervallo')
+    allow_parser = subparsers.add_parser('allow', help='Permetti sempre un numero')
+    allow_parser.add_argument('number', help='Numero da permettere')
+    remove_allow_parser = subparsers.add_parser('remove-allow', help='Rimuovi eccezione numero')
+    remove_allow_parser.add_argument('number', help='Numero')
+    allow_prefix_parser = subparsers.add_parser('allow-prefix', help='Permetti sempre un prefisso')
+    allow_prefix_parser.add_argument('prefix', help='Prefisso da permettere')
+    remove_allow_prefix_parser = subparsers.add_parser('remove-allow-prefix', help='Rimuovi eccezione prefisso')
+    remove_allow_prefix_parser.add_argument('prefix', help='Prefisso')
+    add_rule_parser = subparsers.add_parser('add-rule', help='Aggiungi/sostituisci regola con priorità e orari')
+    add_rule_parser.add_argument('id', help='Identificativo regola')
+    add_rule_parser.add_argument('action', choices=['block', 'allow'], help='Azione')
+    target = add_rule_parser.add_mutually_exclusive_group()
+    target.add_argument('--prefix', help='Prefisso a cui si applica (default: tutti)')
+    target.add_argument('--number', help='Numero esatto a cui si applica')
+    add_rule_parser.add_argument('--priority', type=int, default=DEFAULT_RULE_PRIORITY,
+                                 help=f'Priorità (black-list 0, eccezioni 100, default {DEFAULT_RULE_PRIORITY})')
+    add_rule_parser.add_argument('--days', help='Giorni, 0=lunedì (es. 0-4)')
+    add_rule_parser.add_argument('--hours', help='Ore, fine esclusa (es. 9-20)')
+    remove_rule_parser = subparsers.add_parser('remove-rule', help='Rimuovi regola')
+    remove_rule_parser.add_argument('id', help='Identificativo regola')
+    import_parser = subparsers.add_parser('import', help='Importa una lista esterna (CSV/TXT/JSONL)')
+    import_parser.add_argument('file', help='File da importare ("-" per stdin)')
+    import_parser.add_argument('--source', required=True, help='Nome della fonte (per sostituirla o rimuoverla)')
+    import_parser.add_argument('--format', choices=['txt', 'csv', 'jsonl'], help='Formato (default: da estensione)')
+    import_parser.add_argument('--column', type=int, default=0, help='Colonna del numero nei CSV (da 0)')
+    import_parser.add_argument('--replace', action='store_true', help='Sostituisce il contenuto della fonte')
+    remove_source_parser = subparsers.add_parser('remove-source', help='Rimuovi una lista importata')
+    remove_source_parser.add_argument('source', help='Nome della fonte')
+    subparsers.add_parser('sources', help='Mostra le liste importate')
     subparsers.add_parser('list', help='Mostra black-list')
+    subparsers.add_parser('compile', help='Rigenera lo snapshot binario della black-list')
+    subparsers.add_parser('compact', help='Compatta il journal nel file black-list')
     subparsers.add_parser('enable', help='Abilita filtro')
     subparsers.add_parser('disable', help='Disabilita filtro')
     subparsers.add_parser('block-anonymous', help='Blocca chiamate anonime')
@@ -175,7 +550,29 @@ def main():
     log_parser = subparsers.add_parser('log', help='Mostra log chiamate')
     log_parser.add_argument('-n', '--limit', type=int, default=20, help='Numero chiamate da mostrare')
     log_parser.add_argument('--blocked', action='store_true', help='Solo chiamate bloccate')
+    log_parser.add_argument('--archive', action='store_true', help='Includi le chiamate archiviate')
+    search_parser = subparsers.add_parser('search', help='Cerca nel log chiamate')
+    search_parser.add_argument('number', nargs='?', help='Numero o pattern (es. "+3902*")')
+    search_parser.add_argument('-n', '--limit', type=int, default=50, help='Numero massimo di risultati')
+    export_parser = subparsers.add_parser('export', help='Esporta il log chiamate (CSV/JSONL)')
+    export_parser.add_argument('-o', '--output', default='-', help='File di destinazione (default stdout)')
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help='Formato')
+    export_parser.add_argument('--number', help='Numero o pattern (es. "+3902*")')
+    for sub in (search_parser, export_parser):
+        sub.add_argument('--action', choices=['blocked', 'allowed'], help='Solo chiamate con questa azione')
+        sub.add_argument('--reason', help='Motivo o pattern (es. "auto_repeat*")')
+        sub.add_argument('--since', help='Da (ISO o epoch)')
+        sub.add_argument('--until', help='Fino a, escluso (ISO o epoch)')
+        sub.add_argument('--archive', action='store_true', help='Includi le chiamate archiviate')
+    archive_parser = subparsers.add_parser('archive', help='Archivia le chiamate vecchie in file mensili compressi')
+    archive_parser.add_argument('--days', type=int, default=RETENTION_DAYS,
+                                help=f'Archivia le chiamate più vecchie di N giorni (default {RETENTION_DAYS})')
     subparsers.add_parser('stats', help='Mostra statistiche')
+    check_parser = subparsers.add_parser('check', help='Verifica se un numero verrebbe bloccato')
+    check_parser.add_argument('number', help='Numero da verificare')
+    subparsers.add_parser('status', help='Stato del demone e delle linee')
+    subparsers.add_parser('metrics', help='Metriche del demone in formato Prometheus')
+    subparsers.add_parser('rebuild-stats', help='Ricostruisce le tabelle aggregate delle statistiche')
     args = parser.parse_args()
     if not args.command:
         parser.print_help()
@@ -188,8 +585,32 @@ def main():
         add_prefix(args.prefix)
     elif args.command == 'remove-prefix':
         remove_prefix(args.prefix)
+    elif args.command == 'add-range':
+        add_range(args.start, args.end)
+    elif args.command == 'remove-range':
+        remove_range(args.start, args.end)
+    elif args.command == 'allow':
+        allow_number(args.number)
+    elif args.command == 'remove-allow':
+        remove_allow_number(args.number)
+    elif args.command == 'allow-prefix':
+        allow_prefix(args.prefix)
+    elif args.command == 'remove-allow-prefix':
+        remove_allow_prefix(args.prefix)
+    elif args.command == 'add-rule':
+        add_rule(args.id, args.action, args.prefix, args.number, args.priority, args.days, args.hours)
+    elif args.command == 'remove-rule':
+        remove_rule(args.id)
+    elif args.command == 'import':
+        import_feed(args.file, args.source, args.format, args.column, args.replace)
+    elif args.command == 'remove-source':
+        remove_source(args.source)
+    elif args.command == 'sources':
+        show_sources()
     elif args.command == 'list':
         list_blacklist()
+    elif args.command in ('compile', 'compact'):
+        compact_blacklist()
     elif args.command == 'enable':
         enable_filter(True)
     elif args.command == 'disable':
@@ -199,9 +620,23 @@ def main():
     elif args.command == 'allow-anonymous':
         toggle_anonymous(False)
     elif args.command == 'log':
-        show_log(args.limit, args.blocked)
+        show_log(args.limit, args.blocked, args.archive)
+    elif args.command == 'search':
+        search_log(args.limit, **call_filters(args))
+    elif args.command == 'export':
+        export_log(args.output, args.format, **call_filters(args))
     elif args.command == 'stats':
         show_stats()
+    elif args.command == 'check':
+        check_number(args.number)
+    elif args.command == 'status':
+        show_status()
+    elif args.command == 'metrics':
+        show_metrics()
+    elif args.command == 'archive':
+        archive_log(args.days)
+    elif args.command == 'rebuild-stats':
+        rebuild_stats()
 
 if __name__ == '__main__':
     main()
@@ -1,37 +1,325 @@
 """Gestione black-list con ricarica runtime."""
+import bisect
 import json
 import os
+import threading
 import logging
+from collections import OrderedDict
+
+from blacklist_snapshot import BlacklistSnapshot, snapshot_path
+from blacklist_journal import journal_path, read_journal
+from blacklist_sources import sources_dir, load_sources
+from number_normalizer import DEFAULT_COUNTRY_CODE, NumberNormalizer, normalizer_for
+from rule_engine import (RuleEngine, BLACKLIST_PRIORITY, compile_rule, current_bucket,
+                         blacklist_prefix_rule, allow_number_rule, allow_prefix_rule)
 
 logger = logging.getLogger(__name__)
 
 class BlacklistFilter:
-    def __init__(self, blacklist_file):
+    def __init__(self, blacklist_file, cache_size=1024):
         self.blacklist_file = blacklist_file
+        self.snapshot_file = snapshot_path(blacklist_file)
+        self.journal_file = journal_path(blacklist_file)
+        self.snapshot = None
+        self.normalizer = NumberNormalizer()
         self.enabled = True
         self.numbers = set()
-        self.prefixes = []
+        self.numbers_added = set()
+        self.numbers_removed = set()
+        self.prefixes = set()
+        self.allow_numbers = set()
+        self.allow_prefixes = set()
+        self.custom_rules = {}
+        self.rule_engine = RuleEngine()
+        self.ranges = set()
+        self.ranges_removed = set()
+        self.range_index = {}
         self.block_anonymous = False
-        self.last_mtime = 0
+        self.last_signature = None
+        self.reloads = 0
+        self.journal_seq = 0
+        self.journal_offset = 0
+        self.journal_inode = None
+        # Cache LRU numero → decisione, valida solo per la generazione e l'ora in cui è stata calcolata
+        self.generation = 0
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
         self.load()
         
     def load(self):
         try:
             if not os.path.exists(self.blacklist_file):
                 self._create_empty_blacklist()
-            with open(self.blacklist_file, 'r') as f:
-                data = json.load(f)
-            self.enabled = data.get('enabled', True)
-            self.numbers = set(data.get('numbers', []))
-            self.prefixes = data.get('prefixes', [])
-            self.block_anonymous = data.get('block_anonymous', False)
-            self.last_mtime = os.path.getmtime(self.blacklist_file)
-            logger.info(f"Black-list caricata: {len(self.numbers)} numeri, {len(self.prefixes)} prefissi")
+            signature = self._source_signature()
+            previous_snapshot = self.snapshot
+            snapshot = self._open_snapshot()
+            if snapshot is not None:
+                # Lo snapshot contiene già le chiavi canoniche
+                data = snapshot.meta
+                normalizer = normalizer_for(data)
+                numbers = snapshot
+                prefixes = snapshot.prefixes()
+            else:
+                with open(self.blacklist_file, 'r') as f:
+                    data = json.load(f)
+                normalizer = normalizer_for(data)
+                # Senza snapshot le liste importate vanno unite qui
+                numbers, prefixes = load_sources(sources_dir(self.blacklist_file))
+                numbers.update(normalizer.canonical(n) for n in data.get('numbers', []))
+                prefixes.update(normalizer.canonical_prefixes(data.get('prefixes', [])))
+                numbers.difference_update(data.get('excluded_numbers', []))
+                prefixes.difference_update(data.get('excluded_prefixes', []))
+            ranges = {tuple(normalizer.normalize_entry('ranges', r)) for r in data.get('ranges', [])}
+            allow_numbers = {normalizer.canonical(n) for n in data.get('allow_numbers', [])}
+            allow_prefixes = normalizer.canonical_prefixes(data.get('allow_prefixes', []))
+            custom_rules = self._compile_custom_rules(normalizer, data.get('rules', []))
+            rule_engine = self._compile_rules(prefixes, allow_numbers, allow_prefixes, custom_rules.values())
+            range_index = self._compile_ranges(ranges)
+            entries, offset, inode = read_journal(self.journal_file)
+            with self._lock:
+                self.normalizer = normalizer
+                self.enabled = data.get('enabled', True)
+                self.numbers = numbers
+                self.numbers_added = set()
+                self.numbers_removed = set()
+                self.prefixes = set(prefixes)
+                self.allow_numbers = allow_numbers
+                self.allow_prefixes = allow_prefixes
+                self.custom_rules = custom_rules
+                self.rule_engine = rule_engine
+                self.ranges = ranges
+                self.ranges_removed = set()
+                self.range_index = range_index
+                self.block_anonymous = data.get('block_anonymous', False)
+                self.snapshot = snapshot
+                self.last_signature = signature
+                self.journal_seq = data.get('journal_seq', 0)
+                self._apply_entries(entries, offset, inode)
+                self._bump_generation()
+                self.reloads += 1
+            if previous_snapshot is not None:
+                previous_snapshot.close()
+            source = 'snapshot' if snapshot is not None else 'json'
+            logger.info(f"Black-list caricata ({source}): {len(self.numbers)} numeri, {len(self.prefixes)} prefissi, "
+                        f"{self._range_count()} intervalli, {len(self.allow_numbers) + len(self.allow_prefixes)} eccezioni, "
+                        f"{len(self.custom_rules)} regole, journal fino a seq {self.journal_seq}")
         except Exception as e:
             logger.error(f"Errore caricamento black-list: {e}")
-            
+
+    def _open_snapshot(self):
+        # Lo snapshot vale solo se non è più vecchio del JSON (es. modifiche manuali al file)
+        try:
+            if os.path.getmtime(self.snapshot_file) < os.path.getmtime(self.blacklist_file):
+                return None
+            return BlacklistSnapshot(self.snapshot_file)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Snapshot black-list non utilizzabile, uso JSON: {e}")
+            return None
+
+    def _source_signature(self):
+        # mtime_ns + dimensione + inode: due scritture ravvicinate non sfuggono alla granularità di mtime
+        signature = []
+        for path in (self.blacklist_file, self.snapshot_file):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def apply_journal(self, reload=True):
+        # Applica solo le voci nuove; se il journal è stato compattato serve un load completo,
+        # che con reload=False (percorso di chiamata) resta al thread del watcher.
+        # Un journal nato dopo il caricamento si adotta: le voci sono filtrate per seq
+        try:
+            st = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return 0
+        if not self._same_journal(st.st_ino) or st.st_size < self.journal_offset:
+            if reload:
+                self.load()
+            return 0
+        if st.st_size == self.journal_offset:
+            return 0
+        entries, offset, inode = read_journal(self.journal_file, self.journal_offset)
+        if not self._same_journal(inode):
+            if reload:
+                self.load()
+            return 0
+        with self._lock:
+            if not self._same_journal(inode):
+                # Ricaricato da un altro thread nel frattempo
+                return 0
+            applied = self._apply_entries(entries, offset, inode)
+        if applied:
+            logger.info(f"Applicate {applied} modifiche dal journal (seq {self.journal_seq})")
+        return applied
+
+    def _same_journal(self, inode):
+        return self.journal_inode is None or inode == self.journal_inode
+
+    def apply_ops(self, ops):
+        # Modifiche dal socket di controllo, già scritte nel journal
+        # (riapplicarle dal journal è innocuo: le operazioni sono idempotenti)
+        with self._lock:
+            ranges_changed = False
+            for op in ops:
+                ranges_changed |= self._apply_entry(op)
+            if ranges_changed:
+                self.range_index = self._compile_ranges(self.ranges)
+            self._bump_generation()
+        logger.info(f"Applicate {len(ops)} modifiche dal socket di controllo")
+        return len(ops)
+
+    def _apply_entries(self, entries, offset, inode):
+        applied = 0
+        ranges_changed = False
+        for entry in entries:
+            if entry.get('seq', 0) <= self.journal_seq:
+                continue
+            ranges_changed |= self._apply_entry(entry)
+            self.journal_seq = entry['seq']
+            applied += 1
+        if ranges_changed:
+            self.range_index = self._compile_ranges(self.ranges)
+        if applied:
+            self._bump_generation()
+        self.journal_offset = offset
+        self.journal_inode = inode
+        return applied
+
+    def _apply_entry(self, entry):
+        # True se l'indice degli intervalli va ricompilato (una sola volta per lotto di voci)
+        op = entry.get('op')
+        if op == 'set':
+            if entry['key'] in ('enabled', 'block_anonymous'):
+                setattr(self, entry['key'], bool(entry['value']))
+            return False
+        kind = entry.get('kind')
+        try:
+            value = self.normalizer.normalize_entry(kind, entry.get('value'))
+        except ValueError as e:
+            logger.warning(f"Modifica {kind} ignorata: {e}")
+            return False
+        if kind == 'numbers':
+            if op == 'add':
+                self.numbers_added.add(value)
+                self.numbers_removed.discard(value)
+            elif op == 'remove':
+                self.numbers_removed.add(value)
+                self.numbers_added.discard(value)
+        elif kind in ('prefixes', 'allow_numbers', 'allow_prefixes'):
+            values, make_rule = {'prefixes': (self.prefixes, blacklist_prefix_rule),
+                                 'allow_numbers': (self.allow_numbers, allow_number_rule),
+                                 'allow_prefixes': (self.allow_prefixes, allow_prefix_rule)}[kind]
+            if op == 'add':
+                values.add(value)
+                self.rule_engine.add(make_rule(value))
+            elif op == 'remove':
+                values.discard(value)
+                self._drop_rule(make_rule(value))
+        elif kind == 'rules':
+            previous = self.custom_rules.pop(value.get('id'), None)
+            if previous is not None:
+                self._drop_rule(previous)
+            if op == 'add':
+                rules = self._compile_custom_rules(self.normalizer, [value])
+                self.custom_rules.update(rules)
+                for rule in rules.values():
+                    self.rule_engine.add(rule)
+        elif kind == 'ranges':
+            # Con lo snapshot self.ranges contiene solo gli intervalli aggiunti dopo la sua scrittura
+            value = tuple(value)
+            if op == 'add':
+                self.ranges.add(value)
+                self.ranges_removed.discard(value)
+            elif op == 'remove':
+                self.ranges.discard(value)
+                if self.snapshot is not None:
+                    self.ranges_removed.add(value)
+            return True
+        return False
+
+    @staticmethod
+    def _compile_rules(prefixes, allow_numbers, allow_prefixes, custom_rules):
+        # Prefissi bloccati, eccezioni e regole personalizzate nello stesso trie
+        engine = RuleEngine()
+        for prefix in prefixes:
+            engine.add(blacklist_prefix_rule(prefix))
+        for number in allow_numbers:
+            engine.add(allow_number_rule(number))
+        for prefix in allow_prefixes:
+            engine.add(allow_prefix_rule(prefix))
+        for rule in custom_rules:
+            engine.add(rule)
+        return engine
+
+    @staticmethod
+    def _compile_custom_rules(normalizer, rules):
+        compiled = {}
+        for rule in rules:
+            try:
+                compiled[rule['id']] = compile_rule(normalizer.normalize_entry('rules', rule))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Regola non valida ignorata {rule}: {e}")
+        return compiled
+
+    def _drop_rule(self, rule):
+        self.rule_engine.remove(rule.pattern, rule.reason, rule.exact)
+
+    @staticmethod
+    def _compile_ranges(ranges):
+        # Per numero di cifre: intervalli ordinati e fusi, inizi e fini in due array per la bisezione
+        by_length = {}
+        for start, end in ranges:
+            if len(start) != len(end) or not start[1:].isdigit() or not end[1:].isdigit():
+                logger.warning(f"Intervallo non valido ignorato: {start}-{end}")
+                continue
+            by_length.setdefault(len(start), []).append(tuple(sorted((int(start[1:]), int(end[1:])))))
+        index = {}
+        for length, intervals in by_length.items():
+            intervals.sort()
+            starts, ends = [], []
+            for low, high in intervals:
+                if ends and low <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], high)
+                else:
+                    starts.append(low)
+                    ends.append(high)
+            index[length] = (starts, ends)
+        return index
+
+    def _match_range(self, number):
+        interval = None
+        entry = self.range_index.get(len(number))
+        if entry is not None and number[1:].isdigit():
+            starts, ends = entry
+            value = int(number[1:])
+            i = bisect.bisect_right(starts, value) - 1
+            if i >= 0 and value <= ends[i]:
+                width = len(number) - 1
+                interval = (f"+{starts[i]:0{width}d}", f"+{ends[i]:0{width}d}")
+        if interval is None and self.snapshot is not None:
+            interval = self.snapshot.match_range(number, self.ranges_removed)
+        return None if interval is None else f"{interval[0]}-{interval[1]}"
+
+    def _range_count(self):
+        snapshot_ranges = self.snapshot.range_count if self.snapshot is not None else 0
+        return snapshot_ranges + len(self.ranges) - len(self.ranges_removed)
+
+    def _contains_number(self, number):
+        if number in self.numbers_added:
+            return True
+        return number in self.numbers and number not in self.numbers_removed
+
     def _create_empty_blacklist(self):
-        default_data = {"enabled": True, "block_anonymous": False, "numbers": [], "prefixes": []}
+        default_data = {"enabled": True, "block_anonymous": False, "country_code": DEFAULT_COUNTRY_CODE,
+                        "numbers": [], "prefixes": [], "ranges": []}
         os.makedirs(os.path.dirname(self.blacklist_file), exist_ok=True)
         with open(self.blacklist_file, 'w') as f:
             json.dump(default_data, f, indent=2)
@@ -41,23 +329,85 @@ class BlacklistFilter:
         try:
             if not os.path.exists(self.blacklist_file):
                 return
-            mtime = os.path.getmtime(self.blacklist_file)
-            if mtime > self.last_mtime:
+            if self._source_signature() != self.last_signature:
                 logger.info("Rilevata modifica black-list, ricarico...")
                 self.load()
+            else:
+                self.apply_journal()
         except Exception as e:
             logger.error(f"Errore check reload: {e}")
             
-    def is_blocked(self, number):
+    def _bump_generation(self):
+        # Le voci delle generazioni precedenti non vengono più servite; si svuota per liberare memoria
+        self.generation += 1
+        self.cache.clear()
+
+    def is_blocked(self, number, now=None):
+        bucket = current_bucket(now)
+        with self._lock:
+            entry = self.cache.get(number)
+            if entry is not None and entry[0] == self.generation and entry[1] == bucket:
+                self.cache.move_to_end(number)
+                self.cache_hits += 1
+                return entry[2]
+            self.cache_misses += 1
+            result = self._evaluate(number, bucket)
+            if self.cache_size > 0:
+                self.cache[number] = (self.generation, bucket, result)
+                self.cache.move_to_end(number)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            return result
+
+    def check(self, number, now=None):
+        # Valutazione senza cache né contatori (verifiche a secco dal socket o dalla CLI)
+        bucket = current_bucket(now)
+        with self._lock:
+            return self._evaluate(number, bucket)
+
+    def summary(self):
+        with self._lock:
+            return {'enabled': self.enabled, 'block_anonymous': self.block_anonymous,
+                    'numbers': len(self.numbers) + len(self.numbers_added) - len(self.numbers_removed),
+                    'prefixes': len(self.prefixes), 'ranges': self._range_count(),
+                    'allow': len(self.allow_numbers) + len(self.allow_prefixes), 'rules': len(self.custom_rules),
+                    'source': 'snapshot' if self.snapshot is not None else 'json',
+                    'journal_seq': self.journal_seq, 'generation': self.generation}
+
+    def cache_stats(self):
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {'size': len(self.cache), 'capacity': self.cache_size, 'generation': self.generation,
+                    'hits': self.cache_hits, 'misses': self.cache_misses,
+                    'hit_rate': self.cache_hits / lookups if lookups else 0.0}
+
+    def canonical(self, number):
+        return self.normalizer.canonical(number)
+
+    def is_allowlisted(self, number, now=None):
+        if not number:
+            return False
+        with self._lock:
+            rule = self.rule_engine.match(self.normalizer.canonical(number), current_bucket(now))
+        return rule is not None and rule.action == 'allow'
+
+    def _evaluate(self, number, bucket):
         if not self.enabled:
             return False, "filter_disabled"
         if not number or number.upper() in ['ANONYMOUS', 'PRIVATE', 'WITHHELD', 'UNAVAILABLE']:
             if self.block_anonymous:
                 return True, "anonymous"
             return False, "anonymous_allowed"
-        if number in self.numbers:
+        number = self.normalizer.canonical(number)
+        # Eccezioni e regole con priorità superiore alla black-list vincono su numeri e intervalli
+        rule = self.rule_engine.match(number, bucket)
+        if rule is not None and rule.priority > BLACKLIST_PRIORITY:
+            return rule.action == 'block', rule.reason
+        if self._contains_number(number):
             return True, f"exact_match:{number}"
-        for prefix in self.prefixes:
-            if number.startswith(prefix):
-                return True, f"prefix_match:{prefix}"
+        interval = self._match_range(number)
+        if interval is not None:
+            return True, f"range_match:{interval}"
+        if rule is not None:
+            return rule.action == 'block', rule.reason
         return False, "not_in_blacklist"
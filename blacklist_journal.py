@@ -0,0 +1,170 @@
+"""Journal append-only delle modifiche alla black-list."""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+TAIL_CHUNK = 4096
+# Le rimozioni di numeri e prefissi valgono anche per le liste importate (che non stanno in
+# blacklist.json): restano come esclusioni persistenti, altrimenti la compattazione le farebbe riapparire
+EXCLUDED_KINDS = {'numbers': 'excluded_numbers', 'prefixes': 'excluded_prefixes'}
+
+def journal_path(blacklist_file):
+    return os.path.splitext(blacklist_file)[0] + '.journal'
+
+def inherit_owner(path):
+    # Eseguita con sudo, la CLI creerebbe file root:root che il demone (User=callblocker) non può
+    # più aggiornare: il file prende proprietario e gruppo della directory che lo contiene
+    if os.geteuid() != 0:
+        return
+    st = os.stat(os.path.dirname(os.path.abspath(path)))
+    os.chown(path, st.st_uid, st.st_gid)
+
+def _encode(entry):
+    return (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _tail(f):
+    # Legge solo la coda del file: (seq dell'ultima riga completa, offset di fine di quella riga).
+    # Una riga finale senza '\n' è un append interrotto da un crash e non conta
+    size = f.seek(0, os.SEEK_END)
+    chunk = TAIL_CHUNK
+    while size:
+        start = max(0, size - chunk)
+        f.seek(start)
+        data = f.read(size - start)
+        end = data.rfind(b'\n')
+        if end >= 0:
+            previous = data.rfind(b'\n', 0, end)
+            if previous >= 0 or start == 0:
+                return json.loads(data[previous + 1:end])['seq'], start + end + 1
+        elif start == 0:
+            break
+        chunk *= 2
+    return None, 0
+
+def _last_seq(f):
+    return _tail(f)[0]
+
+@contextmanager
+def journal_lock(path):
+    # Dopo il lock verifica che il file non sia stato sostituito da una compattazione concorrente
+    while True:
+        created = not os.path.exists(path)
+        f = open(path, 'a+b')
+        if created:
+            inherit_owner(path)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield f
+    finally:
+        f.close()
+
+def append_ops(path, ops, base_seq=0):
+    # base_seq serve solo se il journal non esiste ancora: diventa la riga di intestazione
+    with journal_lock(path) as f:
+        seq, end = _tail(f)
+        if end < f.seek(0, os.SEEK_END):
+            # Scarta la riga troncata, altrimenti la prossima voce si attaccherebbe a lei
+            f.truncate(end)
+        data = b''
+        if seq is None:
+            seq = base_seq
+            data += _encode({'seq': seq, 'op': 'base'})
+        for op in ops:
+            seq += 1
+            data += _encode(dict(op, seq=seq))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return seq
+
+def journal_span(path):
+    # (seq base, ultimo seq) in O(1): prima e ultima riga del journal
+    try:
+        with open(path, 'rb') as f:
+            first = f.readline()
+            if not first.endswith(b'\n'):
+                return None
+            return json.loads(first)['seq'], _last_seq(f)
+    except FileNotFoundError:
+        return None
+
+def read_journal(path, offset=0):
+    # Restituisce le voci complete da offset in poi, il nuovo offset e l'inode del file
+    try:
+        with open(path, 'rb') as f:
+            inode = os.fstat(f.fileno()).st_ino
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], 0, None
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].splitlines():
+        if line.strip():
+            entries.append(json.loads(line))
+    return entries, offset + end, inode
+
+def reset_journal(path, seq):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_encode({'seq': seq, 'op': 'base'}))
+        f.flush()
+        os.fsync(f.fileno())
+    inherit_owner(tmp_path)
+    os.replace(tmp_path, path)
+
+def _item_key(value):
+    # Le regole sono identificate dal loro id, gli intervalli dalla coppia di estremi
+    if isinstance(value, dict):
+        return value.get('id')
+    return tuple(value) if isinstance(value, list) else value
+
+def fold_journal(data, entries, normalize=None):
+    # Applica le voci con seq successivo a quello già incorporato nel file base;
+    # normalize(kind, value) rende equivalenti le varianti dello stesso valore
+    base_seq = data.get('journal_seq', 0)
+    indexes = {}
+
+    def index(kind):
+        if kind not in indexes:
+            indexes[kind] = {_item_key(v): v for v in data.get(kind, [])}
+        return indexes[kind]
+
+    for entry in entries:
+        seq = entry.get('seq', 0)
+        if seq <= base_seq:
+            continue
+        op = entry.get('op')
+        if op == 'set':
+            data[entry['key']] = entry['value']
+        elif op in ('add', 'remove'):
+            kind, value = entry['kind'], entry['value']
+            try:
+                if normalize is not None:
+                    value = normalize(kind, value)
+            except ValueError:
+                # Voce non più valida (es. prefisso '00'): il seq avanza, il valore no
+                value = None
+            if value is not None:
+                key = _item_key(value)
+                items = index(kind)
+                excluded = index(EXCLUDED_KINDS[kind]) if kind in EXCLUDED_KINDS else {}
+                if op == 'add':
+                    items[key] = value
+                    excluded.pop(key, None)
+                else:
+                    items.pop(key, None)
+                    if kind in EXCLUDED_KINDS:
+                        excluded[key] = value
+        data['journal_seq'] = seq
+    for kind, items in indexes.items():
+        if items or kind in data:
+            data[kind] = list(items.values())
+    return data
@@ -0,0 +1,170 @@
+"""Snapshot binario compatto della black-list (ricerca in-place via mmap)."""
+import json
+import mmap
+import os
+import struct
+import logging
+
+from blacklist_journal import inherit_owner
+from number_normalizer import normalizer_for
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'CBLS'
+VERSION = 3
+# magic, versione, larghezza numeri, larghezza prefissi, n. numeri, n. prefissi, n. intervalli, lunghezza meta
+HEADER = struct.Struct('<4sHHHIIII')
+# Intervallo: cifre, inizio, fine, massima fine fino a questo record (nel gruppo con le stesse cifre)
+RANGE = struct.Struct('<BQQQ')
+MAX_RANGE_DIGITS = 18
+BULK_KEYS = ('numbers', 'prefixes', 'ranges')
+
+def snapshot_path(blacklist_file):
+    return os.path.splitext(blacklist_file)[0] + '.bin'
+
+def _pack_table(values):
+    encoded = sorted({v.encode('ascii') for v in values if v is not None})
+    width = max((len(v) for v in encoded), default=1)
+    return width, encoded, b''.join(v.ljust(width, b'\0') for v in encoded)
+
+def _pack_ranges(ranges):
+    # Ordinati per (cifre, inizio); la fine massima progressiva permette la bisezione anche
+    # con intervalli sovrapposti. Gli estremi non validi vengono scartati
+    records = set()
+    for start, end in ranges:
+        if (len(start) != len(end) or len(start) - 1 > MAX_RANGE_DIGITS or not start.startswith('+')
+                or not end.startswith('+') or not start[1:].isdigit() or not end[1:].isdigit()):
+            logger.warning(f"Intervallo non valido ignorato: {start}-{end}")
+            continue
+        low, high = sorted((int(start[1:]), int(end[1:])))
+        records.add((len(start) - 1, low, high))
+    table = bytearray()
+    length = reach = None
+    for digits, low, high in sorted(records):
+        reach = high if digits != length else max(reach, high)
+        length = digits
+        table += RANGE.pack(digits, low, high, reach)
+    return len(records), bytes(table)
+
+def write_snapshot(data, path, extra_numbers=(), extra_prefixes=()):
+    # Le tabelle contengono solo chiavi canoniche E.164: una ricerca per numero.
+    # extra_*: voci già canoniche delle liste importate, unite a quelle di blacklist.json
+    # (meno le esclusioni, cioè le voci rimosse a mano)
+    data = normalizer_for(data).normalize_blacklist(data)
+    num_width, numbers, num_table = _pack_table((set(data.get('numbers', [])) | set(extra_numbers))
+                                                - set(data.get('excluded_numbers', [])))
+    pfx_width, prefixes, pfx_table = _pack_table((set(data.get('prefixes', [])) | set(extra_prefixes))
+                                                 - set(data.get('excluded_prefixes', [])))
+    range_count, range_table = _pack_ranges(data.get('ranges', []))
+    meta = json.dumps({k: v for k, v in data.items() if k not in BULK_KEYS}).encode('utf-8')
+    header = HEADER.pack(MAGIC, VERSION, num_width, pfx_width, len(numbers), len(prefixes), range_count,
+                         len(meta))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(num_table)
+        f.write(pfx_table)
+        f.write(range_table)
+        f.write(meta)
+        f.flush()
+        os.fsync(f.fileno())
+    inherit_owner(tmp_path)
+    os.replace(tmp_path, path)
+    return len(numbers), len(prefixes)
+
+def read_meta(path):
+    # Solo intestazione e metadati (country_code, opzioni, journal_seq), senza leggere le tabelle
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError(f"snapshot troncato: {path}")
+        magic, version, num_width, pfx_width, num_count, pfx_count, range_count, meta_len = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"formato snapshot non riconosciuto: {path}")
+        f.seek(HEADER.size + num_count * num_width + pfx_count * pfx_width + range_count * RANGE.size)
+        return json.loads(f.read(meta_len).decode('utf-8'))
+
+class BlacklistSnapshot:
+    # Numeri ordinati a larghezza fissa, cercati con bisezione direttamente sul file mappato
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.num_width, self.pfx_width,
+             self.num_count, self.pfx_count, self.range_count, meta_len) = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"formato snapshot non riconosciuto: {path}")
+            self._num_offset = HEADER.size
+            self._pfx_offset = self._num_offset + self.num_count * self.num_width
+            self._range_offset = self._pfx_offset + self.pfx_count * self.pfx_width
+            meta_offset = self._range_offset + self.range_count * RANGE.size
+            if meta_offset + meta_len != len(self._mm):
+                raise ValueError(f"snapshot troncato: {path}")
+            self.meta = json.loads(self._mm[meta_offset:meta_offset + meta_len].decode('utf-8'))
+        except Exception:
+            self._mm.close()
+            raise
+
+    def __len__(self):
+        return self.num_count
+
+    def __contains__(self, number):
+        if not number:
+            return False
+        key = number.encode('ascii', errors='replace')
+        width = self.num_width
+        if len(key) > width:
+            return False
+        key = key.ljust(width, b'\0')
+        mm = self._mm
+        base = self._num_offset
+        lo, hi = 0, self.num_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = base + mid * width
+            entry = mm[start:start + width]
+            if entry < key:
+                lo = mid + 1
+            elif entry > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def prefixes(self):
+        width = self.pfx_width
+        base = self._pfx_offset
+        return [self._mm[base + i * width:base + (i + 1) * width].rstrip(b'\0').decode('ascii')
+                for i in range(self.pfx_count)]
+
+    def match_range(self, number, removed=()):
+        # Bisezione sull'ultimo intervallo con inizio <= numero, poi a ritroso finché la fine massima
+        # lo copre; removed: intervalli tolti dal journal dopo la scrittura dello snapshot
+        if not self.range_count or not number or not number[1:].isdigit():
+            return None
+        length, value = len(number) - 1, int(number[1:])
+        mm = self._mm
+        base = self._range_offset
+        size = RANGE.size
+        lo, hi = 0, self.range_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            digits, low, _, _ = RANGE.unpack_from(mm, base + mid * size)
+            if (digits, low) <= (length, value):
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in range(lo - 1, -1, -1):
+            digits, low, high, reach = RANGE.unpack_from(mm, base + i * size)
+            if digits != length or reach < value:
+                return None
+            if high >= value:
+                interval = (f"+{low:0{length}d}", f"+{high:0{length}d}")
+                if interval not in removed:
+                    return interval
+        return None
+
+    def close(self):
+        if not self._mm.closed:
+            self._mm.close()
@@ -0,0 +1,97 @@
+"""Liste esterne importate (una per fonte), tenute fuori da blacklist.json."""
+import csv
+import json
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+SOURCE_SUFFIX = '.txt'
+PREFIX_MARK = '*'
+SOURCE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+FORMATS = ('txt', 'csv', 'jsonl')
+
+def sources_dir(blacklist_file):
+    return os.path.join(os.path.dirname(blacklist_file), 'sources')
+
+def source_path(directory, name):
+    if not SOURCE_NAME.match(name):
+        raise ValueError(f"nome fonte non valido: {name}")
+    return os.path.join(directory, name + SOURCE_SUFFIX)
+
+def list_sources(directory):
+    try:
+        names = sorted(f[:-len(SOURCE_SUFFIX)] for f in os.listdir(directory) if f.endswith(SOURCE_SUFFIX))
+    except FileNotFoundError:
+        return []
+    return names
+
+def read_source(path):
+    # Una voce canonica per riga; i prefissi terminano con '*'
+    numbers, prefixes = set(), set()
+    with open(path, 'r') as f:
+        for line in f:
+            value = line.rstrip('\n')
+            if value.endswith(PREFIX_MARK):
+                # '+*' (da versioni che accettavano '00' come prefisso) bloccherebbe tutto
+                if len(value) > 2:
+                    prefixes.add(value[:-1])
+            elif value:
+                numbers.add(value)
+    return numbers, prefixes
+
+def load_sources(directory):
+    numbers, prefixes = set(), set()
+    for name in list_sources(directory):
+        try:
+            source_numbers, source_prefixes = read_source(source_path(directory, name))
+        except Exception as e:
+            logger.error(f"Errore lettura fonte {name}: {e}")
+            continue
+        numbers |= source_numbers
+        prefixes |= source_prefixes
+    return numbers, prefixes
+
+def write_source(path, numbers, prefixes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.writelines(n + '\n' for n in sorted(numbers))
+        f.writelines(p + PREFIX_MARK + '\n' for p in sorted(prefixes))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def detect_format(filename):
+    ext = os.path.splitext(filename)[1].lower().lstrip('.')
+    return ext if ext in FORMATS else 'txt'
+
+def iter_feed(stream, fmt='txt', column=0):
+    # Valori grezzi dal feed, in streaming: (valore, è_prefisso)
+    if fmt == 'csv':
+        for row in csv.reader(stream):
+            if len(row) > column:
+                yield _split_mark(row[column].strip())
+    elif fmt == 'jsonl':
+        for line in stream:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, dict):
+                if item.get('prefix'):
+                    yield str(item['prefix']), True
+                elif item.get('number'):
+                    yield str(item['number']), False
+            else:
+                yield _split_mark(str(item))
+    else:
+        for line in stream:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield _split_mark(line)
+
+def _split_mark(value):
+    if value.endswith(PREFIX_MARK):
+        return value[:-1], True
+    return value, False
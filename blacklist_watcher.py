@@ -0,0 +1,128 @@
+"""Ricarica black-list su notifica inotify (fallback a polling)."""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MODIFY
+EVENT_HEADER = struct.Struct('iIII')
+
+def _inotify_init(directory):
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 fallita')
+    if libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK) < 0:
+        err = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(err, f'inotify_add_watch fallita su {directory}')
+    return fd
+
+class BlacklistWatcher:
+    def __init__(self, blacklist, debounce=0.1, poll_interval=2.0):
+        self.blacklist = blacklist
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.watched = {os.path.basename(blacklist.blacklist_file),
+                        os.path.basename(blacklist.snapshot_file),
+                        os.path.basename(blacklist.journal_file)}
+        self.directory = os.path.dirname(os.path.abspath(blacklist.blacklist_file))
+        self.mode = None
+        self._fd = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._pending = False
+        self._deadline = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        try:
+            self._fd = _inotify_init(self.directory)
+            self.mode = 'inotify'
+            target = self._run_inotify
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify non disponibile ({e}), uso polling ogni {self.poll_interval}s")
+            self.mode = 'polling'
+            target = self._run_polling
+        self._thread = threading.Thread(target=target, name='blacklist-watcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Monitoraggio black-list attivo ({self.mode})")
+
+    def stop(self):
+        if self._stop.is_set():
+            return
+        self.mode = None
+        self._stop.set()
+        os.write(self._wake_w, b'x')
+        if self._thread:
+            self._thread.join(timeout=2.0)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def flush(self):
+        # Dal percorso di chiamata: solo le voci nuove del journal, così una modifica fatta un attimo
+        # prima della chiamata vale per questa chiamata. I caricamenti completi (file riscritti,
+        # journal compattato) restano al thread del watcher, di cui non si attende il lock
+        if self.mode is not None:
+            self.blacklist.apply_journal(reload=False)
+
+    def _drain_events(self):
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b'\0').decode(errors='ignore')
+                offset += name_len
+                if mask & IN_Q_OVERFLOW or name in self.watched:
+                    self._pending = True
+                    self._deadline = time.monotonic() + self.debounce
+
+    def _reload(self):
+        self._pending = False
+        self._deadline = None
+        self.blacklist.check_reload()
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            timeout = None
+            if self._deadline is not None:
+                timeout = max(0.0, self._deadline - time.monotonic())
+            try:
+                readable, _, _ = select.select([self._fd, self._wake_r], [], [], timeout)
+            except (OSError, ValueError):
+                return
+            if self._wake_r in readable:
+                return
+            with self._lock:
+                if self._fd in readable:
+                    self._drain_events()
+                if self._pending and time.monotonic() >= self._deadline:
+                    self._reload()
+
+    def _run_polling(self):
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                self.blacklist.check_reload()
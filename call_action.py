@@ -2,29 +2,103 @@
 import time
 import logging
 
+from call_state import DeadlineScheduler, CallTrace, ACTION_TIMER
+
 logger = logging.getLogger(__name__)
 
 class CallAction:
-    def __init__(self, serial_handler, block_wait_time=1.5):
+    # Il blocco è una sequenza a scadenze (ATA → attesa → ATH → OK): il loop di linea
+    # continua a leggere la seriale e chiama poll() quando scade il timer 'action' dello scheduler
+    IDLE = 'idle'
+    ANSWERING = 'answering'
+    HANGING_UP = 'hanging_up'
+
+    def __init__(self, serial_handler, block_wait_time=1.5, ath_timeout=2.0, scheduler=None):
         self.serial = serial_handler
+        self.scheduler = scheduler if scheduler is not None else DeadlineScheduler()
         self.block_wait_time = block_wait_time
-        
-    def block_call(self, number=None, reason="blacklist"):
-        logger.info(f"Blocco chiamata da {number or 'UNKNOWN'} (motivo: {reason})")
+        self.ath_timeout = ath_timeout
+        self.state = self.IDLE
+        self.deadline = None
+        self.number = None
+        self.ata_ok = False
+        self.trace = CallTrace()
+
+    def block_call(self, number=None, reason="blacklist", now=None, trace=None):
+        if self.state != self.IDLE:
+            logger.warning("Blocco già in corso, ignoro chiamata da %s", number or 'UNKNOWN')
+            return False
+        logger.info("Blocco chiamata da %s (motivo: %s)", number or 'UNKNOWN', reason)
         try:
-            resp = self.serial.send_ata()
-            if not resp or 'OK' not in resp:
-                logger.warning("ATA non ha risposto OK")
-            logger.debug(f"Attesa {self.block_wait_time}s prima di riagganciare")
-            time.sleep(self.block_wait_time)
-            resp = self.serial.send_ath()
-            if not resp or 'OK' not in resp:
-                logger.warning("ATH non ha risposto OK")
-            logger.info("Chiamata bloccata con successo")
-            return True
+            self.serial.send_ata(wait_response=False)
         except Exception as e:
             logger.error(f"Errore durante blocco chiamata: {e}")
             return False
-            
+        now = time.monotonic() if now is None else now
+        self.trace = trace if trace is not None else CallTrace()
+        self.trace.mark('ata_sent')
+        self.state = self.ANSWERING
+        self.number = number
+        self.ata_ok = False
+        self._set_deadline(now + self.block_wait_time)
+        logger.debug("Attesa %ss prima di riagganciare", self.block_wait_time)
+        return True
+
+    def is_busy(self):
+        return self.state != self.IDLE
+
+    def next_deadline(self):
+        return self.deadline
+
+    def _set_deadline(self, deadline):
+        self.deadline = deadline
+        if deadline is None:
+            self.scheduler.cancel(ACTION_TIMER)
+        else:
+            self.scheduler.schedule(ACTION_TIMER, deadline)
+
+    def handle_line(self, line):
+        # Consuma le risposte del modem ai comandi della sequenza; le altre righe proseguono
+        if self.state == self.ANSWERING and line in ('OK', 'ERROR'):
+            self.ata_ok = line == 'OK'
+            if self.ata_ok:
+                self.trace.mark('ata_ok')
+            return True
+        if self.state == self.HANGING_UP and line in ('OK', 'ERROR'):
+            if line != 'OK':
+                logger.warning("ATH non ha risposto OK")
+            else:
+                self.trace.mark('ath_ok')
+            self._finish()
+            return True
+        return False
+
+    def poll(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.deadline is None or now < self.deadline:
+            return
+        if self.state == self.ANSWERING:
+            if not self.ata_ok:
+                logger.warning("ATA non ha risposto OK")
+            try:
+                self.serial.send_ath(wait_response=False)
+                self.trace.mark('ath_sent')
+            except Exception as e:
+                logger.error(f"Errore durante blocco chiamata: {e}")
+                self._finish(success=False)
+                return
+            self.state = self.HANGING_UP
+            self._set_deadline(now + self.ath_timeout)
+        elif self.state == self.HANGING_UP:
+            logger.warning("ATH non ha risposto OK")
+            self._finish()
+
+    def _finish(self, success=True):
+        if success:
+            logger.info("Chiamata bloccata con successo")
+        self.state = self.IDLE
+        self._set_deadline(None)
+        self.number = None
+
     def ignore_call(self, number=None):
-        logger.info(f"Chiamata ignorata da {number or 'UNKNOWN'}")
+        logger.info("Chiamata ignorata da %s", number or 'UNKNOWN')
@@ -0,0 +1,96 @@
+"""Archiviazione delle chiamate vecchie in file mensili compressi (calls-AAAA-MM.jsonl.gz)."""
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import time
+import logging
+from datetime import datetime
+from fnmatch import fnmatchcase
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH = 1000
+ARCHIVE_PATTERN = 'calls-*.jsonl.gz'
+
+def archive_path(archive_dir, month):
+    return os.path.join(archive_dir, f"calls-{month}.jsonl.gz")
+
+def archive_months(archive_dir):
+    names = glob.glob(os.path.join(archive_dir, ARCHIVE_PATTERN))
+    return sorted(os.path.basename(n)[len('calls-'):-len('.jsonl.gz')] for n in names)
+
+def archive_calls(db_file, archive_dir, older_than_days, batch=ARCHIVE_BATCH):
+    # Prima si scrive (e sincronizza) l'archivio, poi si cancella in una transazione breve: lo scrittore
+    # del demone non resta mai bloccato a lungo. Un'interruzione tra i due passi lascia al più righe
+    # duplicate nell'archivio, che la lettura scarta (gli id in ogni file sono crescenti).
+    # Nessun trigger su DELETE: gli aggregati delle statistiche restano invariati.
+    cutoff = int(time.time() - older_than_days * 86400)
+    os.makedirs(archive_dir, exist_ok=True)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    total = 0
+    try:
+        while True:
+            rows = conn.execute('SELECT * FROM calls WHERE ts < ? ORDER BY id LIMIT ?', (cutoff, batch)).fetchall()
+            if not rows:
+                break
+            by_month = {}
+            for row in rows:
+                month = datetime.fromtimestamp(row['ts']).strftime('%Y-%m')
+                by_month.setdefault(month, []).append(dict(row))
+            for month, items in by_month.items():
+                with open(archive_path(archive_dir, month), 'ab') as raw:
+                    with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                        f.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items).encode('utf-8'))
+                    raw.flush()
+                    os.fsync(raw.fileno())
+            with conn:
+                conn.executemany('DELETE FROM calls WHERE id = ?', [(row['id'],) for row in rows])
+            total += len(rows)
+    finally:
+        conn.close()
+    if total:
+        logger.info(f"Archiviate {total} chiamate più vecchie di {older_than_days} giorni in {archive_dir}")
+    return total
+
+def _month_bounds(month):
+    start = datetime.strptime(month, '%Y-%m')
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start.timestamp(), end.timestamp()
+
+def _read_month(path):
+    last_id = 0
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            if row['id'] <= last_id:
+                continue
+            last_id = row['id']
+            yield row
+
+def iter_archived_calls(archive_dir, number=None, action=None, reason=None, since=None, until=None,
+                        newest_first=True):
+    # Stessi filtri di CallLogger.iter_calls (pattern GLOB per number e reason); i mesi fuori
+    # dall'intervallo richiesto non vengono nemmeno aperti. Memoria: un mese alla volta, non costante.
+    # Le righe di un file sono in ordine di id (più blocchi gzip accodati da archiviazioni diverse)
+    # e il gzip non si legge a ritroso: per l'ordine su (ts, id) le righe del mese che passano
+    # i filtri vengono caricate e ordinate. Il picco è quindi il mese più grande dell'intervallo
+    months = archive_months(archive_dir)
+    if newest_first:
+        months.reverse()
+    for month in months:
+        start, end = _month_bounds(month)
+        if (since is not None and end <= since) or (until is not None and start >= until):
+            continue
+        rows = (row for row in _read_month(archive_path(archive_dir, month))
+                if (number is None or fnmatchcase(row['number'] or '', number))
+                and (action is None or row['action'] == action)
+                and (reason is None or fnmatchcase(row['reason'] or '', reason))
+                and (since is None or row['ts'] >= since)
+                and (until is None or row['ts'] < until))
+        if newest_first:
+            yield from sorted(rows, key=lambda r: (r['ts'], r['id']), reverse=True)
+        else:
+            yield from sorted(rows, key=lambda r: (r['ts'], r['id']))
@@ -1,96 +1,360 @@
 """Logging chiamate su SQLite."""
 import sqlite3
 import logging
-from datetime import datetime
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
 import os
+from itertools import chain, islice
+from pathlib import Path
+
+from call_archive import archive_calls, archive_months, iter_archived_calls
 
 logger = logging.getLogger(__name__)
 
+# Tempi della chiamata in millisecondi dal primo RING (NULL se il passo non è avvenuto)
+TIMING_COLUMNS = ('cid_ms', 'decision_ms', 'ata_sent_ms', 'ata_ok_ms', 'ath_sent_ms', 'ath_ok_ms')
+INSERT_CALL = f'''
+    INSERT INTO calls (timestamp, ts, number, action, reason, ring_count, notes, line, {', '.join(TIMING_COLUMNS)})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?{', ?' * len(TIMING_COLUMNS)})
+'''
+_STOP = object()
+PAGE_SIZE = 1000
+GLOB_CHARS = frozenset('*?[')
+SCHEMA_VERSION = 4
+BACKFILL_CHUNK = 5000
+
+# Aggregati aggiornati dal trigger a ogni inserimento: le statistiche non scandiscono più calls
+ROLLUP_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS daily_stats (
+        day TEXT NOT NULL,
+        action TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, action)
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS action_totals (
+        action TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS number_stats (
+        number TEXT NOT NULL,
+        action TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        last_seen TEXT,
+        PRIMARY KEY (number, action)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_number_stats_count ON number_stats(action, count DESC)',
+]
+ROLLUP_TRIGGER = '''CREATE TRIGGER calls_rollup AFTER INSERT ON calls
+    BEGIN
+        INSERT INTO daily_stats (day, action, count)
+            SELECT date(NEW.ts, 'unixepoch', 'localtime'), NEW.action, 1 WHERE NEW.ts IS NOT NULL
+            ON CONFLICT (day, action) DO UPDATE SET count = count + 1;
+        INSERT INTO action_totals (action, count) VALUES (NEW.action, 1)
+            ON CONFLICT (action) DO UPDATE SET count = count + 1;
+        INSERT INTO number_stats (number, action, count, last_seen)
+            SELECT NEW.number, NEW.action, 1, NEW.timestamp WHERE NEW.number IS NOT NULL
+            ON CONFLICT (number, action) DO UPDATE SET count = count + 1, last_seen = excluded.last_seen;
+    END'''
+
+def _migrate_base(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            number TEXT,
+            action TEXT NOT NULL,
+            reason TEXT,
+            ring_count INTEGER,
+            notes TEXT,
+            line TEXT
+        )
+    ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(calls)')}
+    if 'line' not in columns:
+        conn.execute('ALTER TABLE calls ADD COLUMN line TEXT')
+
+def _migrate_rollups(conn):
+    for statement in ROLLUP_SCHEMA:
+        conn.execute(statement)
+
+def _migrate_epoch(conn):
+    # Colonna ts (epoch UTC intero) indicizzata; il backfill procede a blocchi di id per non
+    # tenere il database bloccato a lungo su storici grandi
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(calls)')}
+    if 'ts' not in columns:
+        conn.execute('ALTER TABLE calls ADD COLUMN ts INTEGER')
+    max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM calls').fetchone()[0]
+    for start in range(0, max_id, BACKFILL_CHUNK):
+        conn.execute('''UPDATE calls SET ts = CAST(strftime('%s', timestamp, 'utc') AS INTEGER)
+                        WHERE id > ? AND id <= ? AND ts IS NULL''', (start, start + BACKFILL_CHUNK))
+        conn.commit()
+    # Righe storiche con timestamp illeggibile: restano in calls con ts NULL, fuori da statistiche
+    # giornaliere, filtri per data e archiviazione
+    invalid = conn.execute('SELECT COUNT(*) FROM calls WHERE ts IS NULL').fetchone()[0]
+    if invalid:
+        logger.warning(f"{invalid} chiamate con timestamp non valido escluse dagli indici temporali")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ts ON calls(ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_action_ts ON calls(action, ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_number_ts ON calls(number, ts)')
+    conn.execute('DROP INDEX IF EXISTS idx_timestamp')
+    conn.execute('DROP INDEX IF EXISTS idx_number')
+    conn.execute('DROP TRIGGER IF EXISTS calls_rollup')
+    conn.execute(ROLLUP_TRIGGER)
+
+def _migrate_timings(conn):
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(calls)')}
+    for column in TIMING_COLUMNS:
+        if column not in columns:
+            conn.execute(f'ALTER TABLE calls ADD COLUMN {column} REAL')
+
+MIGRATIONS = [(1, _migrate_base), (2, _migrate_rollups), (3, _migrate_epoch), (4, _migrate_timings)]
+
 class CallLogger:
-    def __init__(self, db_file):
+    def __init__(self, db_file, async_writes=False, batch_size=100, archive_dir=None, read_only=False):
+        # read_only: solo interrogazioni (CLI), niente DDL, migrazioni o ricostruzioni sul database del demone
         self.db_file = db_file
-        self._init_database()
+        self.batch_size = batch_size
+        self.archive_dir = archive_dir
+        self.read_only = read_only
+        self._queue = None
+        self._writer = None
+        if not read_only:
+            self._init_database()
+            if async_writes:
+                self.start_writer()
+
+    def _connect_reader(self):
+        if self.read_only:
+            return sqlite3.connect(Path(self.db_file).resolve().as_uri() + '?mode=ro', uri=True, timeout=30)
+        return sqlite3.connect(self.db_file, timeout=30)
         
     def _init_database(self):
         try:
             os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS calls (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    number TEXT,
-                    action TEXT NOT NULL,
-                    reason TEXT,
-                    ring_count INTEGER,
-                    notes TEXT
-                )
-            ''')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON calls(timestamp DESC)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_number ON calls(number)')
-            conn.commit()
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            has_rollups = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                       "AND name = 'daily_stats'").fetchone() is not None
+            for target, migrate in MIGRATIONS:
+                if version < target:
+                    logger.info(f"Migrazione schema database alla versione {target}")
+                    migrate(conn)
+                    conn.execute(f'PRAGMA user_version = {target}')
+                    conn.commit()
             conn.close()
-            logger.info(f"Database inizializzato: {self.db_file}")
+            if not has_rollups:
+                self.rebuild_rollups()
+            logger.info(f"Database inizializzato: {self.db_file} (schema v{SCHEMA_VERSION})")
         except Exception as e:
             logger.error(f"Errore inizializzazione database: {e}")
             
-    def log_call(self, number=None, action='unknown', reason=None, ring_count=0, notes=None):
+    def rebuild_rollups(self):
+        # Ricostruisce gli aggregati da zero (database esistenti o dopo modifiche manuali a calls);
+        # le chiamate archiviate contano ancora: passano da una tabella temporanea
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            source = 'calls'
+            if self.archive_dir and archive_months(self.archive_dir):
+                conn.execute('CREATE TEMP TABLE archived_calls (ts INTEGER, number TEXT, action TEXT, timestamp TEXT)')
+                conn.executemany('INSERT INTO archived_calls VALUES (?, ?, ?, ?)',
+                                 ((r['ts'], r['number'], r['action'], r['timestamp'])
+                                  for r in iter_archived_calls(self.archive_dir, newest_first=False)))
+                source = ('(SELECT ts, number, action, timestamp FROM calls '
+                          'UNION ALL SELECT ts, number, action, timestamp FROM archived_calls)')
+            with conn:
+                conn.execute('DELETE FROM daily_stats')
+                conn.execute('DELETE FROM action_totals')
+                conn.execute('DELETE FROM number_stats')
+                conn.execute(f'''INSERT INTO daily_stats (day, action, count)
+                                 SELECT date(ts, 'unixepoch', 'localtime'), action, COUNT(*)
+                                 FROM {source} WHERE ts IS NOT NULL GROUP BY 1, 2''')
+                conn.execute(f'''INSERT INTO action_totals (action, count)
+                                 SELECT action, COUNT(*) FROM {source} GROUP BY action''')
+                conn.execute(f'''INSERT INTO number_stats (number, action, count, last_seen)
+                                 SELECT number, action, COUNT(*), MAX(timestamp) FROM {source}
+                                 WHERE number IS NOT NULL GROUP BY number, action''')
+            total = conn.execute('SELECT COALESCE(SUM(count), 0) FROM action_totals').fetchone()[0]
+            logger.info(f"Statistiche ricostruite: {total} chiamate")
+            return total
+        finally:
+            conn.close()
+
+    def start_writer(self):
+        # Scrittore dedicato: una connessione WAL persistente, inserimenti a lotti fuori dal percorso di chiamata
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, name='call-logger', daemon=True)
+        self._writer.start()
+
+    def _writer_loop(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        except Exception as e:
+            logger.error(f"Errore configurazione WAL: {e}")
+        logger.info(f"Scrittura asincrona attiva su {self.db_file}")
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rows = [item for item in batch if item is not _STOP]
+            stop = len(rows) < len(batch)
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(INSERT_CALL, rows)
+                    logger.debug("Registrate %d chiamate", len(rows))
+                except Exception as e:
+                    logger.error(f"Errore registrazione di {len(rows)} chiamate: {e}")
+        conn.close()
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def close(self):
+        # Svuota la coda prima di uscire: nessuna chiamata accodata va persa all'arresto
+        if self._writer is None:
+            return
+        self._queue.put(_STOP)
+        self._writer.join(timeout=10.0)
+        if self._writer.is_alive():
+            logger.warning(f"Scrittore log non terminato, {self.queue_depth()} chiamate in coda")
+        self._writer = None
+        self._queue = None
+
+    def log_call(self, number=None, action='unknown', reason=None, ring_count=0, notes=None, line=None,
+                 timings=None):
         try:
-            timestamp = datetime.now().isoformat()
+            now = time.time()
+            timestamp = datetime.fromtimestamp(now).isoformat()
+            timings = timings or {}
+            row = (timestamp, int(now), number, action, reason, ring_count, notes, line,
+                   *(timings.get(column) for column in TIMING_COLUMNS))
+            if self._queue is not None:
+                self._queue.put_nowait(row)
+                logger.info("Chiamata accodata: %s - %s - %s", number or 'UNKNOWN', action, reason)
+                return True
             conn = sqlite3.connect(self.db_file)
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO calls (timestamp, number, action, reason, ring_count, notes)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (timestamp, number, action, reason, ring_count, notes))
+            cursor.execute(INSERT_CALL, row)
             conn.commit()
             conn.close()
-            logger.info(f"Chiamata registrata: {number or 'UNKNOWN'} - {action} - {reason}")
+            logger.info("Chiamata registrata: %s - %s - %s", number or 'UNKNOWN', action, reason)
             return True
         except Exception as e:
             logger.error(f"Errore registrazione chiamata: {e}")
             return False
             
-    def get_recent_calls(self, limit=50):
+    def iter_calls(self, number=None, action=None, reason=None, since=None, until=None,
+                   newest_first=True, page_size=PAGE_SIZE, include_archive=False):
+        # Con include_archive le chiamate archiviate seguono (o precedono) quelle del database
+        filters = {'number': number, 'action': action, 'reason': reason, 'since': since, 'until': until}
+        live = self._iter_live(newest_first=newest_first, page_size=page_size, **filters)
+        if not include_archive or not self.archive_dir:
+            return live
+        archived = iter_archived_calls(self.archive_dir, newest_first=newest_first, **filters)
+        return chain(live, archived) if newest_first else chain(archived, live)
+
+    def archive(self, older_than_days):
+        if not self.archive_dir or older_than_days <= 0:
+            return 0
         try:
-            conn = sqlite3.connect(self.db_file)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM calls ORDER BY timestamp DESC LIMIT ?', (limit,))
-            rows = cursor.fetchall()
+            return archive_calls(self.db_file, self.archive_dir, older_than_days)
+        except Exception as e:
+            logger.error(f"Errore archiviazione chiamate: {e}")
+            return 0
+
+    def _iter_live(self, number=None, action=None, reason=None, since=None, until=None,
+                   newest_first=True, page_size=PAGE_SIZE):
+        # Generatore a pagine con keyset su (ts, id): ogni pagina è una query breve, nessun lock
+        # resta aperto tra una pagina e l'altra e la memoria resta costante anche su anni di storico.
+        # number e reason accettano pattern GLOB (es. '+3902*', 'auto_repeat*').
+        # Le righe senza ts (timestamp storico illeggibile) romperebbero il keyset e restano fuori
+        filters, params = ['ts IS NOT NULL'], []
+        for column, value in (('number', number), ('reason', reason)):
+            if value is not None:
+                filters.append(f"{column} GLOB ?" if GLOB_CHARS & set(value) else f"{column} = ?")
+                params.append(value)
+        if action is not None:
+            filters.append('action = ?')
+            params.append(action)
+        if since is not None:
+            filters.append('ts >= ?')
+            params.append(int(since))
+        if until is not None:
+            filters.append('ts < ?')
+            params.append(int(until))
+        order = 'DESC' if newest_first else 'ASC'
+        keyset = '(ts, id) < (?, ?)' if newest_first else '(ts, id) > (?, ?)'
+        conn = self._connect_reader()
+        conn.row_factory = sqlite3.Row
+        try:
+            last = None
+            while True:
+                where = filters + [keyset] if last is not None else filters
+                query = 'SELECT * FROM calls WHERE ' + ' AND '.join(where)
+                query += f' ORDER BY ts {order}, id {order} LIMIT ?'
+                page = conn.execute(query, params + list(last or ()) + [page_size]).fetchall()
+                for row in page:
+                    yield dict(row)
+                if len(page) < page_size:
+                    return
+                last = (page[-1]['ts'], page[-1]['id'])
+        finally:
             conn.close()
-            return [dict(row) for row in rows]
+
+    def get_recent_calls(self, limit=50):
+        try:
+            return list(islice(self.iter_calls(page_size=min(limit, PAGE_SIZE)), limit))
         except Exception as e:
             logger.error(f"Errore recupero chiamate: {e}")
             return []
             
-    def get_stats(self):
+    def get_stats(self, top=5):
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = self._connect_reader()
             cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM calls')
-            total = cursor.fetchone()[0]
-            cursor.execute("SELECT COUNT(*) FROM calls WHERE action = 'blocked'")
-            blocked = cursor.fetchone()[0]
+            totals = dict(cursor.execute('SELECT action, count FROM action_totals'))
+            total = sum(totals.values())
+            blocked = totals.get('blocked', 0)
             today = datetime.now().date().isoformat()
-            cursor.execute('SELECT COUNT(*) FROM calls WHERE date(timestamp) = ?', (today,))
-            today_count = cursor.fetchone()[0]
+            today_counts = dict(cursor.execute('SELECT action, count FROM daily_stats WHERE day = ?', (today,)))
+            week_ago = (datetime.now() - timedelta(days=7)).date().isoformat()
+            week_counts = dict(cursor.execute('''SELECT action, SUM(count) FROM daily_stats
+                                                WHERE day >= ? GROUP BY action''', (week_ago,)))
+            cursor.execute('''SELECT number, count FROM number_stats WHERE action = 'blocked'
+                              ORDER BY count DESC LIMIT ?''', (top,))
+            top_blocked = cursor.fetchall()
             conn.close()
-            return {'total_calls': total, 'blocked_calls': blocked, 'allowed_calls': total - blocked, 'today_calls': today_count}
+            return {'total_calls': total, 'blocked_calls': blocked, 'allowed_calls': total - blocked,
+                    'today_calls': sum(today_counts.values()), 'today_blocked': today_counts.get('blocked', 0),
+                    'week_calls': sum(week_counts.values()), 'week_blocked': week_counts.get('blocked', 0),
+                    'top_blocked': top_blocked}
         except Exception as e:
             logger.error(f"Errore calcolo statistiche: {e}")
             return {}
             
-    def search_by_number(self, number):
+    def get_calls_since(self, since):
+        # (ts, numero) in ordine cronologico, via idx_ts: serve a inizializzare il rilevamento ripetute
         try:
-            conn = sqlite3.connect(self.db_file)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM calls WHERE number = ? ORDER BY timestamp DESC', (number,))
-            rows = cursor.fetchall()
+            conn = self._connect_reader()
+            rows = conn.execute('''SELECT ts, number FROM calls WHERE ts >= ? AND number IS NOT NULL
+                                   ORDER BY ts, id''', (int(since),)).fetchall()
             conn.close()
-            return [dict(row) for row in rows]
+            return rows
+        except Exception as e:
+            logger.error(f"Errore recupero chiamate recenti: {e}")
+            return []
+
+    def search_by_number(self, number, limit=None):
+        try:
+            return list(islice(self.iter_calls(number=number), limit))
         except Exception as e:
             logger.error(f"Errore ricerca numero: {e}")
             return []
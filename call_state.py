@@ -0,0 +1,178 @@
+"""Stato della chiamata per linea (IDLE → RINGING → CID_WAIT → DECIDED → ACTING) e scadenze monotone."""
+import heapq
+import itertools
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+IDLE = 'idle'
+RINGING = 'ringing'        # squilli in corso, Caller ID non ancora iniziato
+CID_WAIT = 'cid_wait'      # Caller ID in arrivo (data/ora/nome ricevuti, numero non ancora)
+DECIDED = 'decided'        # decisione presa, chiamata permessa: squilla fino al timeout RING
+ACTING = 'acting'          # sequenza di blocco in corso (ATA → attesa → ATH)
+
+# Nomi dei timer di una linea
+RING_TIMER = 'ring'        # ring_timeout dall'ultimo RING: la chiamata è finita
+CLIP_TIMER = 'clip'        # clip_wait_timeout dal primo RING: si decide come anonima
+ACTION_TIMER = 'action'    # prossimo passo della sequenza di blocco
+
+# Proroga dell'attesa Caller ID se allo scadere il messaggio è già iniziato (numero in arrivo)
+CID_GRACE = 1.0
+
+# Punti della traccia di una chiamata, nell'ordine in cui avvengono
+TRACE_POINTS = ('ring', 'cid', 'decision', 'ata_sent', 'ata_ok', 'ath_sent', 'ath_ok')
+
+class DeadlineScheduler:
+    # Heap di scadenze su time.monotonic(): un timer per nome, la riprogrammazione lascia
+    # la voce vecchia nell'heap e la si scarta quando arriva in testa (cancellazione pigra)
+    def __init__(self):
+        self.heap = []
+        self.active = {}
+        self._seq = itertools.count()
+
+    def schedule(self, name, deadline):
+        seq = next(self._seq)
+        self.active[name] = seq
+        heapq.heappush(self.heap, (deadline, seq, name))
+
+    def cancel(self, name):
+        self.active.pop(name, None)
+
+    def cancel_all(self):
+        self.active.clear()
+        self.heap.clear()
+
+    def pending(self, name):
+        return name in self.active
+
+    def next_deadline(self):
+        heap = self.heap
+        while heap and self.active.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def timeout(self, now=None):
+        # Attesa massima per la select: None se non ci sono scadenze (linea ferma, nessun polling)
+        deadline = self.next_deadline()
+        if deadline is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, deadline - now)
+
+    def expired(self, now=None):
+        now = time.monotonic() if now is None else now
+        names = []
+        while self.next_deadline() is not None and self.heap[0][0] <= now:
+            _, _, name = heapq.heappop(self.heap)
+            del self.active[name]
+            names.append(name)
+        return names
+
+    def __len__(self):
+        return len(self.active)
+
+class CallTrace:
+    # Istanti monotoni dei passi della chiamata; ogni punto si segna una volta sola
+    __slots__ = TRACE_POINTS
+
+    def __init__(self):
+        for point in TRACE_POINTS:
+            setattr(self, point, None)
+
+    def mark(self, point, now=None):
+        if getattr(self, point) is None:
+            setattr(self, point, time.monotonic() if now is None else now)
+
+    def durations(self):
+        # Millisecondi dal primo evento (di norma il primo RING; il Caller ID ETSI può precederlo)
+        marks = [getattr(self, point) for point in TRACE_POINTS]
+        known = [m for m in marks if m is not None]
+        if not known:
+            return {}
+        origin = min(known)
+        return {f"{point}_ms": None if mark is None else round((mark - origin) * 1000, 1)
+                for point, mark in zip(TRACE_POINTS[1:], marks[1:])}
+
+class CallState:
+    def __init__(self, name, scheduler, ring_timeout=8.0, clip_wait_timeout=3.0):
+        self.name = name
+        self.scheduler = scheduler
+        self.ring_timeout = ring_timeout
+        self.clip_wait_timeout = clip_wait_timeout
+        self.reset()
+
+    def reset(self):
+        self.state = IDLE
+        self.number = None
+        self.ring_count = 0
+        self.caller_id_received = False
+        self.action_taken = False
+        self.clip_extended = False
+        # Istanti monotoni del primo RING e della decisione
+        self.started = None
+        self.decided_at = None
+        self.trace = CallTrace()
+        self.scheduler.cancel(RING_TIMER)
+        self.scheduler.cancel(CLIP_TIMER)
+
+    def _enter(self, state):
+        if state != self.state:
+            logger.debug("[%s] Stato chiamata: %s → %s", self.name, self.state, state)
+            self.state = state
+
+    def on_ring(self, count, now):
+        # count: contatore del RingDetector; il primo RING apre la chiamata e arma l'attesa del Caller ID
+        self.ring_count = count
+        self.trace.mark('ring', now)
+        self.scheduler.schedule(RING_TIMER, now + self.ring_timeout)
+        if self.state == IDLE:
+            self.started = now
+            self._enter(RINGING)
+            self.scheduler.schedule(CLIP_TIMER, now + self.clip_wait_timeout)
+            return True
+        return False
+
+    def on_cid_fragment(self):
+        # Riga di Caller ID senza numero (DATE/TIME/NAME): il messaggio è iniziato
+        if self.state == RINGING:
+            self._enter(CID_WAIT)
+
+    def extend_clip_wait(self, now, grace=CID_GRACE):
+        # Una sola proroga per chiamata: un messaggio rimasto a metà non rinvia la decisione all'infinito
+        if self.clip_extended:
+            return False
+        self.clip_extended = True
+        self.scheduler.schedule(CLIP_TIMER, now + grace)
+        return True
+
+    def awaiting_decision(self):
+        return self.state in (IDLE, RINGING, CID_WAIT) and not self.action_taken
+
+    def decide(self, number, now, caller_id_received=True):
+        # Da IDLE: Caller ID arrivato prima del primo RING (ETSI), si decide subito
+        if self.started is None:
+            self.started = now
+        self.number = number
+        self.caller_id_received = caller_id_received
+        self.action_taken = True
+        self.decided_at = now
+        if caller_id_received:
+            self.trace.mark('cid', now)
+        self.scheduler.cancel(CLIP_TIMER)
+        self._enter(DECIDED)
+        if not self.scheduler.pending(RING_TIMER):
+            self.scheduler.schedule(RING_TIMER, now + self.ring_timeout)
+
+    def on_action_started(self):
+        self._enter(ACTING)
+
+    def elapsed(self, now=None):
+        if self.started is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return now - self.started
+
+    def as_dict(self):
+        return {'state': self.state, 'number': self.number, 'ring_count': self.ring_count,
+                'caller_id_received': self.caller_id_received, 'action_taken': self.action_taken}
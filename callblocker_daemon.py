@@ -2,134 +2,182 @@
 """Call Blocker Daemon - Sistema di blocco chiamate analogiche."""
 import sys
 import signal
-import time
+import threading
 import logging
 import argparse
+import configparser
 import os
+import time
 from pathlib import Path
 
-from serial_handler import SerialHandler
-from ring_detector import RingDetector
-from caller_id import CallerIDParser
 from blacklist_filter import BlacklistFilter
-from call_action import CallAction
+from blacklist_watcher import BlacklistWatcher
 from call_logger import CallLogger
+from phone_line import PhoneLine
+from repeat_detector import RepeatDetector
+from control_socket import ControlServer
+from metrics import Metrics, write_textfile
+from app_logging import LogPipeline
 
 class CallBlockerDaemon:
     def __init__(self, config):
         self.config = config
+        # Per primo: anche i messaggi del caricamento iniziale passano dalla coda
+        self.log_pipeline = LogPipeline(config['log_level'], config['log_file'],
+                                        json_format=config['log_format'] == 'json',
+                                        max_bytes=config['log_max_bytes'], backup_count=config['log_backup_count'],
+                                        queue_size=config['log_queue_size']).start()
         self.running = False
-        self.serial = SerialHandler(device=config['device'], baudrate=config['baudrate'])
-        self.ring_detector = RingDetector(ring_timeout=config['ring_timeout'])
-        self.caller_id = CallerIDParser()
-        self.blacklist = BlacklistFilter(config['blacklist_file'])
-        self.action = CallAction(self.serial, block_wait_time=config['block_wait_time'])
-        self.logger = CallLogger(config['log_db'])
-        self.current_call = {'number': None, 'ring_count': 0, 'caller_id_received': False, 'action_taken': False}
-        self._setup_logging(config['log_level'])
-        
-    def _setup_logging(self, level_str):
-        level = getattr(logging, level_str.upper(), logging.INFO)
-        logging.basicConfig(level=level, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                          handlers=[logging.StreamHandler(sys.stdout), logging.FileHandler('/var/log/callblocker.log')])
+        self.stopped = threading.Event()
+        self.blacklist = BlacklistFilter(config['blacklist_file'], cache_size=config['decision_cache_size'])
+        self.blacklist_watcher = BlacklistWatcher(self.blacklist, debounce=config['blacklist_debounce'],
+                                                  poll_interval=config['blacklist_poll_interval'])
+        self.logger = CallLogger(config['log_db'], async_writes=config['log_async'],
+                                 archive_dir=config['archive_dir'])
+        self.archiver = None
+        self.metrics = Metrics()
+        self.metrics_writer = None
+        self.repeat_detector = None
+        if config['repeat_max_calls'] > 0:
+            self.repeat_detector = RepeatDetector(max_calls=config['repeat_max_calls'],
+                                                  window=config['repeat_window_minutes'] * 60,
+                                                  block_duration=config['repeat_block_minutes'] * 60,
+                                                  prefix_length=config['repeat_prefix_length'],
+                                                  prefix_max_calls=config['repeat_prefix_max_calls'])
+        devices = config.get('devices') or [config['device']]
+        self.lines = [PhoneLine(device, config, self.blacklist, self.blacklist_watcher, self.logger,
+                                self.repeat_detector, self.metrics) for device in devices]
+        self.control = ControlServer(self, config['control_socket'])
         
     def start(self):
         logging.info("=== Call Blocker Daemon avvio ===")
-        logging.info(f"Dispositivo: {self.config['device']}")
+        logging.info(f"Dispositivi: {', '.join(line.device for line in self.lines)}")
         logging.info(f"Black-list: {self.config['blacklist_file']}")
-        if not self.serial.open():
-            logging.error("Impossibile aprire la porta seriale")
-            return False
-        if not self.serial.initialize_modem():
-            logging.error("Impossibile inizializzare il modem")
+        if self.repeat_detector is not None:
+            since = time.time() - self.config['repeat_window_minutes'] * 60
+            self.repeat_detector.seed(self.logger.get_calls_since(since), canonical=self.blacklist.canonical)
+        started = [line for line in self.lines if line.start()]
+        if not started:
+            logging.error("Nessuna linea disponibile")
             return False
+        if len(started) < len(self.lines):
+            logging.warning(f"Attive {len(started)} linee su {len(self.lines)}")
+        self.lines = started
+        self.blacklist_watcher.start()
+        self.control.start()
+        if self.config['retention_days'] > 0:
+            self.archiver = threading.Thread(target=self._archive_loop, name='archiver', daemon=True)
+            self.archiver.start()
+        if self.config['metrics_file'] and self.config['metrics_interval'] > 0:
+            self.metrics_writer = threading.Thread(target=self._metrics_loop, name='metrics', daemon=True)
+            self.metrics_writer.start()
         self.running = True
         logging.info("Demone pronto, in ascolto...")
         return True
         
     def stop(self):
+        if not self.running:
+            return
         logging.info("Arresto demone...")
         self.running = False
-        self.serial.close()
+        for line in self.lines:
+            line.stop()
+        self.control.stop()
+        self.blacklist_watcher.stop()
+        self.logger.close()
+        cache = self.blacklist.cache_stats()
+        logging.info(f"Cache decisioni: {cache['hits']} hit, {cache['misses']} miss ({cache['hit_rate']:.0%})")
+        self.stopped.set()
         logging.info("Demone fermato")
+        self.log_pipeline.stop()
         
-    def reset_call_state(self):
-        self.current_call = {'number': None, 'ring_count': 0, 'caller_id_received': False, 'action_taken': False}
-        self.ring_detector.reset()
-        self.caller_id.reset()
-        
-    def process_call(self):
-        if self.current_call['action_taken']:
-            return
-        number = self.current_call['number']
-        ring_count = self.current_call['ring_count']
-        is_blocked, reason = self.blacklist.is_blocked(number)
-        if is_blocked:
-            logging.info(f"Chiamata BLOCCATA: {number or 'ANONYMOUS'} ({reason})")
-            self.action.block_call(number, reason)
-            self.logger.log_call(number=number, action='blocked', reason=reason, ring_count=ring_count)
-            self.current_call['action_taken'] = True
-        else:
-            logging.info(f"Chiamata PERMESSA: {number or 'UNKNOWN'} ({reason})")
-            self.logger.log_call(number=number, action='allowed', reason=reason, ring_count=ring_count)
-            self.current_call['action_taken'] = True
-            
-    def main_loop(self):
-        last_blacklist_check = time.time()
-        while self.running:
+    def _archive_loop(self):
+        # Ritenzione: una passata poco dopo l'avvio, poi a intervalli regolari
+        wait = 60.0
+        while not self.stopped.wait(wait):
+            self.logger.archive(self.config['retention_days'])
+            wait = self.config['archive_interval_hours'] * 3600
+
+    def _metrics_loop(self):
+        path = self.config['metrics_file']
+        while not self.stopped.wait(self.config['metrics_interval']):
             try:
-                if time.time() - last_blacklist_check > 2.0:
-                    self.blacklist.check_reload()
-                    last_blacklist_check = time.time()
-                lines = self.serial.read_available()
-                for line in lines:
-                    ring_event = self.ring_detector.process_line(line)
-                    if ring_event:
-                        if ring_event['type'] == 'ring':
-                            self.current_call['ring_count'] = ring_event['count']
-                            if ring_event['count'] == 1:
-                                logging.info("Prima squillo, attesa Caller ID...")
-                        elif ring_event['type'] == 'timeout':
-                            if self.current_call['ring_count'] > 0:
-                                logging.info("Timeout RING, reset stato")
-                                self.reset_call_state()
-                    number = self.caller_id.parse_line(line)
-                    if number:
-                        self.current_call['number'] = number
-                        self.current_call['caller_id_received'] = True
-                        self.process_call()
-                if (self.ring_detector.is_ringing() and not self.current_call['caller_id_received'] and
-                    not self.current_call['action_taken'] and self.current_call['ring_count'] >= 2):
-                    logging.info("Caller ID non ricevuto, processo chiamata come anonima")
-                    self.current_call['number'] = None
-                    self.current_call['caller_id_received'] = True
-                    self.process_call()
-                time.sleep(0.05)
-            except KeyboardInterrupt:
-                logging.info("Ricevuto SIGINT")
-                break
+                write_textfile(path, self.metrics.render(self))
             except Exception as e:
-                logging.error(f"Errore nel main loop: {e}", exc_info=True)
-                time.sleep(1)
+                logging.error(f"Errore scrittura metriche su {path}: {e}")
+
+    def main_loop(self):
+        # Ogni linea gira nel proprio thread: un blocco in corso su una linea non ritarda le altre
+        try:
+            self.stopped.wait()
+        except KeyboardInterrupt:
+            logging.info("Ricevuto SIGINT")
         self.stop()
 
+DEFAULT_CONFIG = {
+    'device': '/dev/ttyACM0', 'devices': None, 'baudrate': 9600, 'ring_timeout': 8.0,
+    'clip_wait_timeout': 3.0, 'block_wait_time': 1.5,
+    'blacklist_file': '/var/lib/callblocker/blacklist.json',
+    'blacklist_debounce': 0.1, 'blacklist_poll_interval': 2.0,
+    'decision_cache_size': 1024,
+    'repeat_max_calls': 0, 'repeat_window_minutes': 10, 'repeat_block_minutes': 60,
+    'repeat_prefix_length': 0, 'repeat_prefix_max_calls': 20,
+    'control_socket': '/run/callblocker/control.sock',
+    'metrics_file': '/run/callblocker/metrics.prom', 'metrics_interval': 15,
+    'log_db': '/var/lib/callblocker/calls.db',
+    'archive_dir': '/var/lib/callblocker/archive', 'retention_days': 365, 'archive_interval_hours': 24, 'log_async': True,
+    'log_level': 'INFO', 'log_file': '/var/log/callblocker.log', 'log_format': 'text',
+    'log_max_bytes': 10 * 2 ** 20, 'log_backup_count': 5, 'log_queue_size': 10000
+}
+
 def load_config(config_file):
-    return {
-        'device': '/dev/ttyACM0', 'baudrate': 9600, 'ring_timeout': 8.0,
-        'clip_wait_timeout': 3.0, 'block_wait_time': 1.5,
-        'blacklist_file': '/var/lib/callblocker/blacklist.json',
-        'log_db': '/var/lib/callblocker/calls.db', 'log_level': 'INFO'
-    }
+    # Default sovrascritti dalle chiavi di daemon.conf; le sezioni servono solo a raggrupparle.
+    # Un file assente lascia i default, un valore non valido ferma l'avvio
+    config = dict(DEFAULT_CONFIG)
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        if not parser.read(config_file, encoding='utf-8'):
+            return config
+    except configparser.Error as e:
+        print(f"Errore lettura configurazione {config_file}: {e}", file=sys.stderr)
+        sys.exit(1)
+    for section in parser.sections():
+        for key, value in parser.items(section):
+            if key not in config:
+                print(f"Chiave sconosciuta ignorata in {config_file}: [{section}] {key}", file=sys.stderr)
+                continue
+            try:
+                config[key] = parse_config_value(key, value)
+            except ValueError:
+                print(f"Valore non valido in {config_file}: [{section}] {key} = {value}", file=sys.stderr)
+                sys.exit(1)
+    return config
+
+def parse_config_value(key, value):
+    # Il tipo è quello del default
+    default = DEFAULT_CONFIG[key]
+    if key == 'devices':
+        return [d.strip() for d in value.split(',') if d.strip()] or None
+    if isinstance(default, bool):
+        if value.lower() not in configparser.ConfigParser.BOOLEAN_STATES:
+            raise ValueError(value)
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
 
 def main():
     parser = argparse.ArgumentParser(description='Call Blocker Daemon')
     parser.add_argument('-c', '--config', help='File configurazione', default='/etc/callblocker/daemon.conf')
-    parser.add_argument('-d', '--device', help='Device seriale', default='/dev/ttyACM0')
+    parser.add_argument('-d', '--device', action='append',
+                        help='Device seriale (ripetibile per servire più linee)')
     parser.add_argument('-v', '--verbose', action='store_true', help='Modalità verbose (DEBUG)')
     args = parser.parse_args()
     config = load_config(args.config)
     if args.device:
-        config['device'] = args.device
+        config['devices'] = args.device
     if args.verbose:
         config['log_level'] = 'DEBUG'
     daemon = CallBlockerDaemon(config)
@@ -143,6 +191,7 @@ def main():
         daemon.main_loop()
     else:
         logging.error("Impossibile avviare il demone")
+        daemon.log_pipeline.stop()
         sys.exit(1)
 
 if __name__ == '__main__':
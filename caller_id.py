@@ -1,45 +1,193 @@
 """Parsing Caller ID (CLIP)."""
-import re
+import csv
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Codici "reason for absence" (Bellcore/ETSI): O = fuori area/non disponibile, P = privato
+ABSENCE_CODES = {'O': 'unavailable', 'P': 'private'}
+# +CLIP: "numero",tipo,"subaddr",satype,"alpha",validità (1 = ritenuto, 2 = non disponibile)
+CLIP_VALIDITY = {'1': 'private', '2': 'unavailable'}
+NUMBER_CHARS = frozenset('0123456789+')
+HEX_CHARS = frozenset('0123456789ABCDEFabcdef')
+SDMF_TYPE = 0x04
+MDMF_TYPE = 0x80
+MDMF_DATETIME = 0x01
+MDMF_NUMBER = 0x02
+MDMF_NUMBER_ABSENCE = 0x04
+MDMF_NAME = 0x07
+MDMF_NAME_ABSENCE = 0x08
+
 class CallerIDParser:
     def __init__(self):
-        self.patterns = [
-            re.compile(r'NMBR\s*=\s*([0-9+]+)'),
-            re.compile(r'\+CLIP:\s*"([0-9+]+)"'),
-            re.compile(r'CALLER\s+NUMBER:\s*([0-9+]+)'),
-            re.compile(r'([0-9+]{6,})'),
-        ]
+        # Un solo passaggio per riga: dispatch sulla chiave prima di '=' o ':'
+        self.fields = {
+            'NMBR': self._field_number,
+            'CALLER NUMBER': self._field_number,
+            'NAME': self._field_name,
+            'CALLER NAME': self._field_name,
+            'DATE': self._field_date,
+            'TIME': self._field_time,
+            'MESG': self._field_message,
+            'DDN_NMBR': self._field_dialed,
+        }
         self.current_number = None
-        
+        self.current = self._empty_info()
+
+    @staticmethod
+    def _empty_info():
+        return {'number': None, 'name': None, 'date': None, 'time': None,
+                'absence': None, 'name_absence': None, 'dialed': None, 'message': None, 'format': None}
+
     def parse_line(self, line):
+        # Restituisce le informazioni CID quando numero o motivo di assenza sono noti, altrimenti None
         if not line:
             return None
-        for pattern in self.patterns:
-            match = pattern.search(line)
-            if match:
-                number = match.group(1)
-                self.current_number = self.normalize_number(number)
-                logger.info(f"Caller ID rilevato: {self.current_number}")
-                return self.current_number
+        line = line.strip()
+        if line.startswith('+CLIP:'):
+            return self._parse_clip(line[6:])
+        if line[:2] in ('04', '80'):
+            frame = line.replace(' ', '')
+            if len(frame) >= 6 and len(frame) % 2 == 0 and set(frame) <= HEX_CHARS:
+                return self._parse_frame(bytes.fromhex(frame))
+        sep = line.find('=')
+        if sep < 0:
+            sep = line.find(':')
+        if sep < 0:
+            return None
+        handler = self.fields.get(line[:sep].strip().upper())
+        if handler is None:
+            return None
+        return handler(line[sep + 1:].strip())
+
+    def _field_number(self, value):
+        code = value.upper()
+        if code in ABSENCE_CODES:
+            return self._set_number(None, absence=ABSENCE_CODES[code], fmt='text')
+        value = value.replace(' ', '').replace('-', '')
+        if not value or not set(value) <= NUMBER_CHARS:
+            return None
+        return self._set_number(value, fmt='text')
+
+    def _field_name(self, value):
+        code = value.upper()
+        if code in ABSENCE_CODES:
+            self.current['name_absence'] = ABSENCE_CODES[code]
+        else:
+            self.current['name'] = value
+        return None
+
+    def _field_date(self, value):
+        self.current['date'] = value
+        return None
+
+    def _field_time(self, value):
+        self.current['time'] = value
+        return None
+
+    def _field_message(self, value):
+        self.current['message'] = value
+        return None
+
+    def _field_dialed(self, value):
+        self.current['dialed'] = value
+        return None
+
+    def _parse_clip(self, payload):
+        try:
+            fields = next(csv.reader([payload.strip()], skipinitialspace=True))
+        except (csv.Error, StopIteration):
+            return None
+        if not fields:
+            return None
+        number = fields[0].strip()
+        if len(fields) > 4 and fields[4]:
+            self.current['name'] = fields[4]
+        validity = fields[5].strip() if len(fields) > 5 else '0'
+        if number and set(number) <= NUMBER_CHARS:
+            return self._set_number(number, fmt='clip')
+        if validity in CLIP_VALIDITY:
+            return self._set_number(None, absence=CLIP_VALIDITY[validity], fmt='clip')
         return None
-        
+
+    def _parse_frame(self, frame):
+        # Frame grezzo da AT+VCID=2: tipo, lunghezza, payload, checksum (somma mod 256 = 0)
+        if len(frame) < 3 or frame[1] != len(frame) - 3 or sum(frame) & 0xFF:
+            logger.debug("Frame CID scartato (lunghezza/checksum non validi): %s", frame.hex())
+            return None
+        payload = frame[2:-1]
+        if frame[0] == SDMF_TYPE:
+            return self._parse_sdmf(payload)
+        if frame[0] == MDMF_TYPE:
+            return self._parse_mdmf(payload)
+        return None
+
+    def _parse_sdmf(self, payload):
+        if len(payload) < 9:
+            return None
+        stamp = payload[:8].decode('ascii', errors='ignore')
+        self.current['date'], self.current['time'] = stamp[:4], stamp[4:]
+        number = payload[8:].decode('ascii', errors='ignore')
+        if number.upper() in ABSENCE_CODES:
+            return self._set_number(None, absence=ABSENCE_CODES[number.upper()], fmt='sdmf')
+        if not set(number) <= NUMBER_CHARS:
+            return None
+        return self._set_number(number, fmt='sdmf')
+
+    def _parse_mdmf(self, payload):
+        number = absence = None
+        pos = 0
+        while pos + 2 <= len(payload):
+            param, length = payload[pos], payload[pos + 1]
+            value = payload[pos + 2:pos + 2 + length].decode('ascii', errors='ignore')
+            pos += 2 + length
+            if param == MDMF_DATETIME:
+                self.current['date'], self.current['time'] = value[:4], value[4:]
+            elif param == MDMF_NUMBER and value and set(value) <= NUMBER_CHARS:
+                number = value
+            elif param == MDMF_NUMBER_ABSENCE:
+                absence = ABSENCE_CODES.get(value.upper(), value)
+            elif param == MDMF_NAME:
+                self.current['name'] = value
+            elif param == MDMF_NAME_ABSENCE:
+                self.current['name_absence'] = ABSENCE_CODES.get(value.upper(), value)
+        if number is None and absence is None:
+            return None
+        return self._set_number(number, absence=absence, fmt='mdmf')
+
+    def _set_number(self, number, absence=None, fmt=None):
+        if number is not None:
+            number = self.normalize_number(number)
+        self.current['number'] = number
+        self.current['absence'] = absence
+        self.current['format'] = fmt
+        self.current_number = number
+        if number:
+            logger.info("Caller ID rilevato: %s", number)
+        else:
+            logger.info("Caller ID assente (%s)", absence)
+        return dict(self.current)
+
     def normalize_number(self, number):
         number = number.replace(' ', '').replace('-', '')
         if number.startswith('00'):
             number = '+' + number[2:]
         return number
-        
+
     def is_anonymous(self, number):
         if not number:
             return True
         anonymous_markers = ['ANONYMOUS', 'PRIVATE', 'WITHHELD', 'UNAVAILABLE', 'P', 'O', '']
         return number.upper() in anonymous_markers
-        
+
+    def has_partial(self):
+        # Messaggio Caller ID iniziato (data/ora/nome) ma numero non ancora ricevuto
+        info = self.current
+        return info['format'] is None and bool(info['date'] or info['time'] or info['name'])
+
     def get_current_number(self):
         return self.current_number
-        
+
     def reset(self):
         self.current_number = None
+        self.current = self._empty_info()
@@ -0,0 +1,234 @@
+"""Socket Unix di controllo: modifiche in memoria, verifica numeri, statistiche e stato del demone."""
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import logging
+
+from blacklist_journal import append_ops
+from number_normalizer import LIST_KINDS
+from rule_engine import compile_rule
+
+logger = logging.getLogger(__name__)
+
+SOCKET_PATH = '/run/callblocker/control.sock'
+SET_KEYS = ('enabled', 'block_anonymous')
+JOURNAL_TIMEOUT = 10.0
+_STOP = object()
+
+def request(command, path=SOCKET_PATH, timeout=5.0, **params):
+    # Lato client: una richiesta JSON per riga, una risposta JSON per riga.
+    # Restituisce None se il demone non è in ascolto (il chiamante ripiega sui file)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall((json.dumps(dict(params, cmd=command)) + '\n').encode('utf-8'))
+            with sock.makefile('rb') as f:
+                line = f.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    return json.loads(line)
+
+def validate_op(op):
+    # Forma dell'operazione e tipo del valore per ciascuna lista
+    if op.get('op') == 'set':
+        return op.get('key') in SET_KEYS and isinstance(op.get('value'), bool)
+    if op.get('op') not in ('add', 'remove') or op.get('kind') not in LIST_KINDS:
+        return False
+    value = op.get('value')
+    if op['kind'] == 'ranges':
+        return (isinstance(value, list) and len(value) == 2
+                and all(isinstance(v, str) and v for v in value))
+    if op['kind'] == 'rules':
+        return isinstance(value, dict) and isinstance(value.get('id'), str) and bool(value['id'])
+    return isinstance(value, str) and bool(value)
+
+def normalize_op(normalizer, op):
+    # Forma canonica del valore, verificata prima di applicare e di scrivere nel journal:
+    # un valore che non si applica verrebbe altrimenti riletto a ogni caricamento
+    if op['op'] == 'set':
+        return op
+    kind = op['kind']
+    try:
+        value = normalizer.normalize_entry(kind, op['value'])
+        if kind == 'ranges':
+            start, end = value
+            if len(start) != len(end) or not start[1:].isdigit() or not end[1:].isdigit():
+                raise ValueError("estremi non numerici o di lunghezza diversa")
+        elif kind == 'rules':
+            if op['op'] == 'add':
+                compile_rule(value)
+        elif not value:
+            raise ValueError("valore vuoto")
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"valore non valido per {kind} {op['value']!r}: {e}") from None
+    return dict(op, value=value)
+
+class _Edit:
+    # Modifiche di una richiesta in attesa del journal: il writer le salva in lotto e poi le applica
+    def __init__(self, ops):
+        self.ops = ops
+        self.done = threading.Event()
+        self.error = None
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+                response = self.server.control.dispatch(message)
+            except Exception as e:
+                logger.error(f"Errore comando di controllo: {e}")
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class ControlServer:
+    def __init__(self, daemon, path=SOCKET_PATH):
+        self.daemon = daemon
+        self.path = path
+        self.server = None
+        self.thread = None
+        self.started = time.time()
+        # Le modifiche passano da un unico writer: più richieste concorrenti condividono un fsync,
+        # e il client riceve la risposta solo dopo che il journal è su disco
+        self._pending = queue.Queue()
+        self._writer = None
+
+    def start(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = _Server(self.path, _Handler)
+            # Solo l'utente del demone (e root): il socket modifica la black-list come la CLI con sudo
+            os.chmod(self.path, 0o600)
+        except Exception as e:
+            logger.error(f"Socket di controllo non disponibile ({self.path}): {e}")
+            self.server = None
+            return False
+        self.server.control = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name='control', daemon=True)
+        self.thread.start()
+        self._writer = threading.Thread(target=self._writer_loop, name='control-journal', daemon=True)
+        self._writer.start()
+        logger.info(f"Socket di controllo in ascolto su {self.path}")
+        return True
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self._pending.put(_STOP)
+        self._writer.join(timeout=10.0)
+
+    def pending(self):
+        return self._pending.qsize()
+
+    def _writer_loop(self):
+        blacklist = self.daemon.blacklist
+        stop = False
+        while not stop:
+            batch = [self._pending.get()]
+            while True:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            edits = []
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                else:
+                    edits.append(item)
+            if not edits:
+                continue
+            ops = [op for edit in edits for op in edit.ops]
+            try:
+                append_ops(blacklist.journal_file, ops, blacklist.journal_seq)
+                logger.debug(f"Salvate nel journal {len(ops)} modifiche dal socket")
+                # In memoria solo ciò che è già persistito: un errore di scrittura non lascia modifiche
+                # che sparirebbero al riavvio
+                blacklist.apply_ops(ops)
+            except Exception as e:
+                logger.error(f"Errore scrittura journal di {len(ops)} modifiche: {e}")
+                for edit in edits:
+                    edit.error = e
+            for edit in edits:
+                edit.done.set()
+
+    def dispatch(self, message):
+        handler = getattr(self, f"cmd_{message.get('cmd', '').replace('-', '_')}", None)
+        if handler is None:
+            return {'ok': False, 'error': f"comando sconosciuto: {message.get('cmd')}"}
+        return dict(handler(message), ok=True)
+
+    def cmd_ping(self, message):
+        return {}
+
+    def cmd_apply(self, message):
+        blacklist = self.daemon.blacklist
+        ops = message.get('ops') or []
+        invalid = [op for op in ops if not isinstance(op, dict) or not validate_op(op)]
+        if invalid:
+            raise ValueError(f"operazioni non valide: {invalid}")
+        ops = [normalize_op(blacklist.normalizer, op) for op in ops]
+        edit = _Edit(ops)
+        self._pending.put(edit)
+        if not edit.done.wait(JOURNAL_TIMEOUT):
+            raise TimeoutError(f"journal non scritto entro {JOURNAL_TIMEOUT:.0f} s")
+        if edit.error is not None:
+            raise OSError(f"modifiche non salvate nel journal: {edit.error}")
+        return {'applied': len(ops), 'ops': ops}
+
+    def cmd_check(self, message):
+        # Prova a secco: stessa valutazione del percorso di chiamata (blocchi automatici compresi),
+        # senza contare la chiamata né toccare la cache delle decisioni
+        blacklist = self.daemon.blacklist
+        repeat_detector = self.daemon.repeat_detector
+        number = message.get('number')
+        allowlisted = blacklist.is_allowlisted(number)
+        reason = None
+        if number and repeat_detector is not None and not allowlisted:
+            reason = repeat_detector.active_block(blacklist.canonical(number))
+        if reason:
+            blocked = True
+        else:
+            blocked, reason = blacklist.check(number)
+        return {'number': number, 'canonical': blacklist.canonical(number) if number else None,
+                'blocked': blocked, 'reason': reason, 'allowlisted': allowlisted}
+
+    def cmd_stats(self, message):
+        daemon = self.daemon
+        stats = {'calls': daemon.logger.get_stats(), 'cache': daemon.blacklist.cache_stats(),
+                 'log_queue': daemon.logger.queue_depth(), 'journal_pending': self.pending()}
+        if daemon.repeat_detector is not None:
+            stats['repeat'] = daemon.repeat_detector.stats()
+        return stats
+
+    def cmd_metrics(self, message):
+        # Testo Prometheus: istogrammi dei tempi di chiamata e contatori del demone
+        return {'text': self.daemon.metrics.render(self.daemon)}
+
+    def cmd_status(self, message):
+        daemon = self.daemon
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started,
+                'blacklist': daemon.blacklist.summary(), 'lines': [line.status() for line in daemon.lines]}
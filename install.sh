@@ -41,12 +41,25 @@ echo_info "Copia file programma..."
 SCRIPT_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 
 cp "$SCRIPT_DIR/callblocker_daemon.py" /opt/callblocker/
+cp "$SCRIPT_DIR/phone_line.py" /opt/callblocker/
 cp "$SCRIPT_DIR/serial_handler.py" /opt/callblocker/
 cp "$SCRIPT_DIR/ring_detector.py" /opt/callblocker/
 cp "$SCRIPT_DIR/caller_id.py" /opt/callblocker/
 cp "$SCRIPT_DIR/blacklist_filter.py" /opt/callblocker/
+cp "$SCRIPT_DIR/blacklist_snapshot.py" /opt/callblocker/
+cp "$SCRIPT_DIR/blacklist_watcher.py" /opt/callblocker/
+cp "$SCRIPT_DIR/blacklist_journal.py" /opt/callblocker/
+cp "$SCRIPT_DIR/blacklist_sources.py" /opt/callblocker/
+cp "$SCRIPT_DIR/number_normalizer.py" /opt/callblocker/
+cp "$SCRIPT_DIR/rule_engine.py" /opt/callblocker/
+cp "$SCRIPT_DIR/repeat_detector.py" /opt/callblocker/
+cp "$SCRIPT_DIR/control_socket.py" /opt/callblocker/
+cp "$SCRIPT_DIR/call_state.py" /opt/callblocker/
 cp "$SCRIPT_DIR/call_action.py" /opt/callblocker/
 cp "$SCRIPT_DIR/call_logger.py" /opt/callblocker/
+cp "$SCRIPT_DIR/metrics.py" /opt/callblocker/
+cp "$SCRIPT_DIR/app_logging.py" /opt/callblocker/
+cp "$SCRIPT_DIR/call_archive.py" /opt/callblocker/
 cp "$SCRIPT_DIR/blacklist_cli.py" /opt/callblocker/
 
 chmod +x /opt/callblocker/callblocker_daemon.py
@@ -77,6 +90,12 @@ EOJ
     chmod 644 /var/lib/callblocker/blacklist.json
 fi
 
+if [ ! -f /etc/callblocker/daemon.conf ]; then
+    echo_info "Creazione daemon.conf iniziale..."
+    cp "$SCRIPT_DIR/daemon.conf.example" /etc/callblocker/daemon.conf
+    chmod 644 /etc/callblocker/daemon.conf
+fi
+
 echo_info "Installazione servizio systemd..."
 cp "$SCRIPT_DIR/callblocker.service" /etc/systemd/system/
 systemctl daemon-reload
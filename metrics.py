@@ -0,0 +1,117 @@
+"""Metriche in formato testo Prometheus: istogrammi dei tempi di chiamata e contatori del demone."""
+import os
+import threading
+import time
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Limiti superiori (secondi) dei bucket: dal Caller ID al millisecondo fino all'ATH dopo qualche secondo
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Passi tracciati (colonne *_ms di calls), misurati dal primo RING
+STAGES = ('cid', 'decision', 'ata_sent', 'ata_ok', 'ath_sent', 'ath_ok')
+
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class Metrics:
+    # Gli istogrammi si aggiornano a fine chiamata; contatori e livelli delle code si leggono
+    # dal demone al momento dell'esportazione, senza costi sul percorso di chiamata
+    def __init__(self):
+        self.stages = {}
+        self.calls = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe_call(self, line, action, timings):
+        with self._lock:
+            self.calls[(line, action)] = self.calls.get((line, action), 0) + 1
+            for stage in STAGES:
+                value = timings.get(f"{stage}_ms")
+                if value is None:
+                    continue
+                histogram = self.stages.get((line, stage))
+                if histogram is None:
+                    histogram = self.stages[(line, stage)] = Histogram()
+                histogram.observe(value / 1000)
+
+    def render(self, daemon=None):
+        out = []
+        with self._lock:
+            out += ['# HELP callblocker_call_stage_seconds Tempo dal primo RING a ciascun passo della chiamata',
+                    '# TYPE callblocker_call_stage_seconds histogram']
+            for (line, stage), histogram in sorted(self.stages.items()):
+                out += histogram.render('callblocker_call_stage_seconds', f'line="{line}",stage="{stage}"')
+            out += ['# HELP callblocker_calls_total Chiamate registrate per linea ed esito',
+                    '# TYPE callblocker_calls_total counter']
+            out += [f'callblocker_calls_total{{line="{line}",action="{action}"}} {count}'
+                    for (line, action), count in sorted(self.calls.items())]
+        if daemon is not None:
+            out += self._daemon_metrics(daemon)
+        return '\n'.join(out) + '\n'
+
+    def _daemon_metrics(self, daemon):
+        blacklist = daemon.blacklist
+        cache = blacklist.cache_stats()
+        summary = blacklist.summary()
+        app_log = daemon.log_pipeline.stats()
+        values = [
+            ('callblocker_uptime_seconds', 'gauge', "Secondi dall'avvio del demone",
+             [('', round(time.time() - self.started, 1))]),
+            ('callblocker_blacklist_reloads_total', 'counter', 'Caricamenti completi della black-list',
+             [('', blacklist.reloads)]),
+            ('callblocker_blacklist_generation', 'gauge', 'Generazione corrente delle regole',
+             [('', summary['generation'])]),
+            ('callblocker_blacklist_numbers', 'gauge', 'Numeri in black-list', [('', summary['numbers'])]),
+            ('callblocker_decision_cache_hits_total', 'counter', 'Decisioni servite dalla cache',
+             [('', cache['hits'])]),
+            ('callblocker_decision_cache_misses_total', 'counter', 'Decisioni calcolate', [('', cache['misses'])]),
+            ('callblocker_decision_cache_entries', 'gauge', 'Voci nella cache decisioni', [('', cache['size'])]),
+            ('callblocker_serial_errors_total', 'counter', 'Errori di lettura seriale per linea',
+             [(f'line="{line.name}"', line.serial.errors) for line in daemon.lines]),
+            ('callblocker_log_queue_depth', 'gauge', 'Chiamate in attesa di scrittura su SQLite',
+             [('', daemon.logger.queue_depth())]),
+            ('callblocker_app_log_queue_depth', 'gauge', 'Messaggi di log in attesa di scrittura',
+             [('', app_log['queued'])]),
+            ('callblocker_app_log_dropped_total', 'counter', 'Messaggi di log scartati a coda piena',
+             [('', app_log['dropped'])]),
+            ('callblocker_journal_queue_depth', 'gauge', 'Modifiche dal socket in attesa di journal',
+             [('', daemon.control.pending())]),
+        ]
+        if daemon.repeat_detector is not None:
+            values.append(('callblocker_repeat_auto_blocked', 'gauge', 'Blocchi automatici attivi',
+                           [('', daemon.repeat_detector.stats()['auto_blocked'])]))
+        out = []
+        for name, kind, help_text, samples in values:
+            out += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            out += [f'{name}{{{labels}}} {value}' if labels else f'{name} {value}' for labels, value in samples]
+        return out
+
+def write_textfile(path, text):
+    # Scrittura atomica, per il textfile collector di node_exporter
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
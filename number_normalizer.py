@@ -0,0 +1,148 @@
+"""Normalizzazione dei numeri in forma canonica E.164 (+<prefisso paese><numero nazionale>)."""
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY_CODE = '39'
+
+# Prefissi internazionali ITU-T E.164 (l'insieme è privo di prefissi: al massimo un match per lunghezza)
+COUNTRY_CODES = frozenset('''
+1 7 20 27 30 31 32 33 34 36 39 40 41 43 44 45 46 47 48 49 51 52 53 54 55 56 57 58 60 61 62 63 64 65 66
+81 82 84 86 90 91 92 93 94 95 98 211 212 213 216 218 220 221 222 223 224 225 226 227 228 229 230 231
+232 233 234 235 236 237 238 239 240 241 242 243 244 245 246 247 248 249 250 251 252 253 254 255 256 257
+258 260 261 262 263 264 265 266 267 268 269 290 291 297 298 299 350 351 352 353 354 355 356 357 358 359
+370 371 372 373 374 375 376 377 378 379 380 381 382 383 385 386 387 389 420 421 423 500 501 502 503 504
+505 506 507 508 509 590 591 592 593 594 595 596 597 598 599 670 672 673 674 675 676 677 678 679 680 681
+682 683 685 686 687 688 689 690 691 692 800 808 850 852 853 855 856 870 878 880 881 882 883 886 888 960
+961 962 963 964 965 966 967 968 970 971 972 973 974 975 976 977 979 992 993 994 995 996 998
+'''.split())
+
+# Piano di numerazione: (prefisso internazionale, prefisso di trunk nazionale).
+# Dove il trunk è vuoto (Italia, San Marino, Vaticano, Spagna, ...) lo 0 iniziale fa parte del numero.
+NUMBERING_PLANS = {
+    '1': ('011', '1'), '7': ('810', '8'), '20': ('00', '0'), '27': ('00', '0'), '30': ('00', ''),
+    '31': ('00', '0'), '32': ('00', '0'), '33': ('00', '0'), '34': ('00', ''), '36': ('00', '06'),
+    '39': ('00', ''), '40': ('00', '0'), '41': ('00', '0'), '43': ('00', '0'), '44': ('00', '0'),
+    '45': ('00', ''), '46': ('00', '0'), '47': ('00', ''), '48': ('00', ''), '49': ('00', '0'),
+    '351': ('00', ''), '352': ('00', ''), '353': ('00', '0'), '356': ('00', ''), '358': ('00', '0'),
+    '359': ('00', '0'), '370': ('00', '8'), '371': ('00', ''), '372': ('00', ''), '377': ('00', ''),
+    '378': ('00', ''), '379': ('00', ''), '380': ('00', '0'), '381': ('00', '0'), '385': ('00', '0'),
+    '386': ('00', '0'), '387': ('00', '0'), '420': ('00', ''), '421': ('00', '0'), '423': ('00', ''),
+    '61': ('0011', '0'), '64': ('00', '0'), '81': ('010', '0'), '86': ('00', '0'), '90': ('00', '0'),
+    '91': ('00', '0'),
+}
+
+LIST_KINDS = ('numbers', 'prefixes', 'ranges', 'allow_numbers', 'allow_prefixes', 'rules')
+SEPARATORS = str.maketrans('', '', ' -./()\t')
+
+class NumberNormalizer:
+    def __init__(self, country_code=DEFAULT_COUNTRY_CODE):
+        self.country_code = str(country_code).lstrip('+')
+        self.international_prefix, self.trunk_prefix = NUMBERING_PLANS.get(self.country_code, ('00', ''))
+
+    @staticmethod
+    def split_country_code(digits):
+        for length in (1, 2, 3):
+            if digits[:length] in COUNTRY_CODES:
+                return digits[:length]
+        return None
+
+    def canonical(self, number):
+        # Numero completo in arrivo o in black-list → chiave unica; valori non numerici restano invariati
+        if not number:
+            return number
+        # Percorsi rapidi per i casi comuni, senza translate
+        if number.isdigit():
+            return self._national(number, strip_trunk=True)
+        if number[0] == '+' and number[1:].isdigit():
+            return self._international(number[1:], strip_trunk=True)
+        cleaned = number.translate(SEPARATORS)
+        if cleaned.startswith('+'):
+            digits = cleaned[1:]
+            return self._international(digits, strip_trunk=True) if digits.isdigit() else cleaned
+        if not cleaned.isdigit():
+            return cleaned
+        return self._national(cleaned, strip_trunk=True)
+
+    def canonical_prefix(self, prefix):
+        # Come canonical(), ma non rimuove il trunk dopo il prefisso paese: '+440' non deve diventare '+44'.
+        # Un prefisso internazionale da solo ('00', '+') diventerebbe '+', cioè tutti i numeri: è un errore
+        if not prefix:
+            return prefix
+        cleaned = prefix.translate(SEPARATORS)
+        if cleaned.isdigit():
+            cleaned = self._national(cleaned, strip_trunk=False)
+        if cleaned == '+':
+            raise ValueError(f"prefisso senza cifre dopo il prefisso internazionale: {prefix}")
+        return cleaned
+
+    def canonical_prefixes(self, prefixes):
+        # Per il caricamento delle liste: i prefissi non validi si scartano senza fermare il resto
+        result = set()
+        for prefix in prefixes:
+            try:
+                result.add(self.canonical_prefix(prefix))
+            except ValueError as e:
+                logger.warning(f"Prefisso ignorato: {e}")
+        return result
+
+    def _national(self, digits, strip_trunk):
+        for intl in (self.international_prefix, '00'):
+            if digits.startswith(intl):
+                return self._international(digits[len(intl):], strip_trunk)
+        trunk = self.trunk_prefix
+        if trunk and digits.startswith(trunk):
+            digits = digits[len(trunk):]
+        return '+' + self.country_code + digits
+
+    def _international(self, digits, strip_trunk):
+        country = self.split_country_code(digits)
+        if country is None or not strip_trunk:
+            return '+' + digits
+        national = digits[len(country):]
+        trunk = NUMBERING_PLANS.get(country, ('00', ''))[1]
+        # Forma "+44 (0)20 ..." scritta di frequente con il trunk nazionale dopo il prefisso paese
+        if trunk and national.startswith(trunk) and len(national) > 6:
+            national = national[len(trunk):]
+        return '+' + country + national
+
+    def normalize_entry(self, kind, value):
+        if kind == 'numbers':
+            return self.canonical(value)
+        if kind == 'prefixes':
+            return self.canonical_prefix(value)
+        if kind == 'allow_numbers':
+            return self.canonical(value)
+        if kind == 'allow_prefixes':
+            return self.canonical_prefix(value)
+        if kind == 'ranges':
+            # Estremi in ordine crescente: un intervallo scritto al contrario è la stessa voce
+            return sorted((self.canonical(value[0]), self.canonical(value[1])))
+        if kind == 'rules' and isinstance(value, dict):
+            value = dict(value)
+            if 'number' in value:
+                value['number'] = self.canonical(value['number'])
+            elif 'prefix' in value:
+                value['prefix'] = self.canonical_prefix(value['prefix'])
+        return value
+
+    def normalize_blacklist(self, data):
+        # Le varianti dello stesso numero collassano in un'unica voce (ordine di inserimento preservato)
+        data = dict(data)
+        for kind in LIST_KINDS:
+            if kind not in data:
+                continue
+            unique = {}
+            for value in data[kind]:
+                try:
+                    value = self.normalize_entry(kind, value)
+                except ValueError as e:
+                    logger.warning(f"Voce {kind} ignorata: {e}")
+                    continue
+                key = value.get('id') if isinstance(value, dict) else value
+                unique[tuple(key) if isinstance(key, list) else key] = value
+            data[kind] = list(unique.values())
+        return data
+
+def normalizer_for(data):
+    return NumberNormalizer(data.get('country_code', DEFAULT_COUNTRY_CODE))
@@ -0,0 +1,174 @@
+"""Gestione di una singola linea telefonica (un modem)."""
+import os
+import threading
+import time
+import logging
+
+from serial_handler import SerialHandler
+from ring_detector import RingDetector
+from caller_id import CallerIDParser
+from call_action import CallAction
+from call_state import (CallState, DeadlineScheduler, IDLE, RINGING, CID_WAIT, DECIDED,
+                        RING_TIMER, CLIP_TIMER, ACTION_TIMER, CID_GRACE)
+
+logger = logging.getLogger(__name__)
+
+class PhoneLine:
+    def __init__(self, device, config, blacklist, blacklist_watcher, call_logger, repeat_detector=None,
+                 metrics=None):
+        self.device = device
+        self.name = os.path.basename(device)
+        self.serial = SerialHandler(device=device, baudrate=config['baudrate'])
+        self.ring_detector = RingDetector(ring_timeout=config['ring_timeout'])
+        self.caller_id = CallerIDParser()
+        self.blacklist = blacklist
+        self.blacklist_watcher = blacklist_watcher
+        self.repeat_detector = repeat_detector
+        # Un solo scheduler per linea: timeout RING, attesa Caller ID e passi della sequenza di blocco
+        self.scheduler = DeadlineScheduler()
+        self.action = CallAction(self.serial, block_wait_time=config['block_wait_time'], scheduler=self.scheduler)
+        self.call = CallState(self.name, self.scheduler, ring_timeout=config['ring_timeout'],
+                              clip_wait_timeout=config['clip_wait_timeout'])
+        self.logger = call_logger
+        self.metrics = metrics
+        # Chiamata bloccata: registrata a fine sequenza, con i tempi di ATA e ATH
+        self.pending_log = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if not self.serial.open():
+            logger.error(f"[{self.name}] Impossibile aprire la porta seriale")
+            return False
+        if not self.serial.initialize_modem():
+            logger.error(f"[{self.name}] Impossibile inizializzare il modem")
+            self.serial.close()
+            return False
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"line-{self.name}", daemon=True)
+        self.thread.start()
+        logger.info(f"[{self.name}] Linea pronta, in ascolto...")
+        return True
+
+    def stop(self):
+        # La chiamata bloccata in sospeso la registra il thread di linea all'uscita, una volta sola
+        self.running = False
+        self.serial.close()
+        if self.thread is not None:
+            self.thread.join(timeout=5.0)
+            if self.thread.is_alive():
+                logger.warning(f"[{self.name}] Thread di linea non terminato")
+
+    def status(self):
+        # Dal thread del socket: solo letture, lo stato della linea lo modifica il suo thread
+        return {'device': self.device, 'name': self.name, 'running': self.running,
+                'ringing': self.call.state != IDLE, 'action': self.action.state,
+                'elapsed': self.call.elapsed(), **self.call.as_dict()}
+
+    def reset_call_state(self):
+        self._flush_pending_log()
+        self.call.reset()
+        self.ring_detector.reset()
+        self.caller_id.reset()
+
+    def process_call(self, number, now=None, caller_id_received=True):
+        if not self.call.awaiting_decision():
+            return
+        now = time.monotonic() if now is None else now
+        self.call.decide(number, now, caller_id_received)
+        ring_count = self.call.ring_count
+        self.blacklist_watcher.flush()
+        reason = None
+        # Le chiamate ripetute si contano prima della black-list; le eccezioni non vengono mai bloccate
+        if number and self.repeat_detector is not None and not self.blacklist.is_allowlisted(number):
+            reason = self.repeat_detector.observe(self.blacklist.canonical(number))
+        if reason:
+            is_blocked = True
+        else:
+            is_blocked, reason = self.blacklist.is_blocked(number)
+        self.call.trace.mark('decision')
+        if is_blocked:
+            logger.info("[%s] Chiamata BLOCCATA: %s (%s)", self.name, number or 'ANONYMOUS', reason)
+            self.pending_log = {'number': number, 'action': 'blocked', 'reason': reason, 'ring_count': ring_count}
+            if self.action.block_call(number, reason, now=now, trace=self.call.trace):
+                self.call.on_action_started()
+            else:
+                self._flush_pending_log()
+        else:
+            logger.info("[%s] Chiamata PERMESSA: %s (%s)", self.name, number or 'UNKNOWN', reason)
+            self._log_call(number=number, action='allowed', reason=reason, ring_count=ring_count)
+
+    def _log_call(self, **call):
+        timings = self.call.trace.durations()
+        self.logger.log_call(line=self.name, timings=timings, **call)
+        if self.metrics is not None:
+            self.metrics.observe_call(self.name, call['action'], timings)
+
+    def _flush_pending_log(self):
+        call, self.pending_log = self.pending_log, None
+        if call is not None:
+            self._log_call(**call)
+
+    def handle_line(self, line, now):
+        if self.action.handle_line(line):
+            if not self.action.is_busy():
+                # ATH confermato: la chiamata bloccata è chiusa
+                self.reset_call_state()
+            return
+        ring_event = self.ring_detector.process_line(line)
+        if ring_event:
+            if ring_event['type'] == 'ring':
+                if self.call.on_ring(ring_event['count'], now):
+                    logger.info("[%s] Primo squillo, attesa Caller ID (max %ss)...", self.name,
+                                self.call.clip_wait_timeout)
+            elif ring_event['type'] == 'timeout' and self.call.ring_count > 0:
+                logger.info("[%s] Timeout RING, reset stato", self.name)
+                self.reset_call_state()
+        caller = self.caller_id.parse_line(line)
+        if caller:
+            # Numero assente (privato/non disponibile): si decide subito come anonima
+            self.process_call(caller['number'], now)
+        elif self.call.state == RINGING and self.caller_id.has_partial():
+            self.call.on_cid_fragment()
+
+    def handle_deadline(self, timer, now):
+        if timer == ACTION_TIMER:
+            self.action.poll(now)
+            if not self.action.is_busy():
+                self.reset_call_state()
+        elif timer == CLIP_TIMER:
+            if self.call.state in (RINGING, CID_WAIT):
+                partial = self.call.state == CID_WAIT or self.caller_id.has_partial()
+                if partial and self.call.extend_clip_wait(now):
+                    logger.info("[%s] Caller ID in arrivo allo scadere dell'attesa, proroga di %ss", self.name,
+                                CID_GRACE)
+                    return
+                logger.info("[%s] Caller ID non ricevuto entro %ss, processo chiamata come anonima", self.name,
+                            self.call.clip_wait_timeout)
+                self.process_call(None, now, caller_id_received=False)
+        elif timer == RING_TIMER:
+            if self.action.is_busy():
+                # La sequenza di blocco chiude da sé la chiamata
+                return
+            if self.call.state == DECIDED:
+                logger.info("[%s] Fine squilli, chiamata terminata", self.name)
+            else:
+                logger.info("[%s] Timeout RING, reset stato", self.name)
+            self.reset_call_state()
+
+    def run(self):
+        # Nessun polling: la select attende la prossima scadenza, o indefinitamente a linea ferma
+        while self.running:
+            try:
+                lines = self.serial.read_lines(timeout=self.scheduler.timeout())
+                now = time.monotonic()
+                for line in lines:
+                    self.handle_line(line, now)
+                for timer in self.scheduler.expired(now):
+                    self.handle_deadline(timer, now)
+            except Exception as e:
+                if not self.running:
+                    break
+                logger.error(f"[{self.name}] Errore nel loop di linea: {e}", exc_info=True)
+                time.sleep(1)
+        self._flush_pending_log()
@@ -0,0 +1,116 @@
+"""Rilevamento chiamate ripetute (finestra scorrevole in memoria) con blocco automatico a scadenza."""
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+class SlidingWindow:
+    # Per chiave solo gli ultimi max_calls + 1 istanti (buffer circolare): memoria limitata per costruzione
+    def __init__(self, max_calls, window, max_keys):
+        self.max_calls = max_calls
+        self.window = window
+        self.max_keys = max_keys
+        self.keys = OrderedDict()
+
+    def record(self, key, now):
+        # True se con questa chiamata la chiave supera max_calls nella finestra
+        times = self.keys.get(key)
+        if times is None:
+            times = self.keys[key] = deque(maxlen=self.max_calls + 1)
+        else:
+            self.keys.move_to_end(key)
+        times.append(now)
+        self._evict(now)
+        return len(times) == times.maxlen and now - times[0] <= self.window
+
+    def _evict(self, now):
+        # Le chiavi sono in ordine di ultimo accesso: basta guardare in testa
+        keys = self.keys
+        while keys:
+            key, times = next(iter(keys.items()))
+            if len(keys) <= self.max_keys and now - times[-1] <= self.window:
+                break
+            keys.popitem(last=False)
+
+    def __len__(self):
+        return len(self.keys)
+
+class RepeatDetector:
+    def __init__(self, max_calls=5, window=600.0, block_duration=3600.0, prefix_length=0,
+                 prefix_max_calls=20, max_keys=10000):
+        self.block_duration = block_duration
+        self.prefix_length = prefix_length
+        self.numbers = SlidingWindow(max_calls, window, max_keys)
+        self.prefixes = SlidingWindow(prefix_max_calls, window, max_keys) if prefix_length > 0 else None
+        self.blocked = {}
+        self._lock = threading.Lock()
+
+    def observe(self, number, now=None):
+        # Registra la chiamata (numero canonico) e restituisce il motivo se è bloccata automaticamente
+        if not number or not number.startswith('+'):
+            return None
+        now = time.time() if now is None else now
+        prefix = number[:self.prefix_length + 1] if self.prefixes is not None else None
+        with self._lock:
+            reason = self._active_block(number, now) or (prefix and self._active_block(prefix, now))
+            if self.numbers.record(number, now):
+                reason = reason or self._start_block(number, f"auto_repeat:{number}", now)
+            if prefix and self.prefixes.record(prefix, now):
+                reason = reason or self._start_block(prefix, f"auto_repeat_prefix:{prefix}", now)
+            return reason
+
+    def active_block(self, number, now=None):
+        # Blocco automatico in corso sul numero (o sul suo prefisso), senza registrare una chiamata
+        if not number or not number.startswith('+'):
+            return None
+        now = time.time() if now is None else now
+        with self._lock:
+            reason = self._active_block(number, now)
+            if reason is None and self.prefixes is not None:
+                reason = self._active_block(number[:self.prefix_length + 1], now)
+            return reason
+
+    def _active_block(self, key, now):
+        entry = self.blocked.get(key)
+        if entry is None:
+            return None
+        expiry, reason = entry
+        if now < expiry:
+            return reason
+        del self.blocked[key]
+        logger.info(f"Blocco automatico scaduto: {key}")
+        return None
+
+    def _start_block(self, key, reason, now):
+        if key not in self.blocked:
+            logger.warning(f"Blocco automatico per chiamate ripetute: {key} "
+                           f"(fino a {time.strftime('%H:%M', time.localtime(now + self.block_duration))})")
+        self.blocked[key] = (now + self.block_duration, reason)
+        if len(self.blocked) > self.numbers.max_keys:
+            self._purge_expired(now)
+        return reason
+
+    def _purge_expired(self, now):
+        for key in [k for k, (expiry, _) in self.blocked.items() if expiry <= now]:
+            del self.blocked[key]
+
+    def seed(self, calls, canonical=None):
+        # calls: (ts, numero) in ordine cronologico, es. le chiamate degli ultimi minuti dal database
+        count = 0
+        for ts, number in calls:
+            if canonical is not None:
+                number = canonical(number)
+            self.observe(number, ts)
+            count += 1
+        with self._lock:
+            self._purge_expired(time.time())
+            active = len(self.blocked)
+        logger.info(f"Rilevamento ripetute inizializzato da {count} chiamate, {active} blocchi automatici attivi")
+        return count
+
+    def stats(self):
+        with self._lock:
+            return {'numbers': len(self.numbers), 'prefixes': len(self.prefixes) if self.prefixes is not None else 0,
+                    'auto_blocked': len(self.blocked)}
@@ -5,6 +5,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 class RingDetector:
+    # Istanti su time.monotonic(): un passo dell'orologio (NTP) non altera i timeout
     def __init__(self, ring_timeout=8.0):
         self.ring_timeout = ring_timeout
         self.ring_count = 0
@@ -13,13 +14,13 @@ class RingDetector:
         
     def reset(self):
         if self.ring_count > 0:
-            logger.debug(f"Reset ring counter (era {self.ring_count})")
+            logger.debug("Reset ring counter (era %d)", self.ring_count)
         self.ring_count = 0
         self.last_ring_time = None
         self.in_call_state = False
         
     def process_line(self, line):
-        current_time = time.time()
+        current_time = time.monotonic()
         if self.last_ring_time and (current_time - self.last_ring_time) > self.ring_timeout:
             self.reset()
             return {'type': 'timeout'}
@@ -27,7 +28,7 @@ class RingDetector:
             self.ring_count += 1
             self.last_ring_time = current_time
             self.in_call_state = True
-            logger.info(f"RING rilevato (count: {self.ring_count})")
+            logger.info("RING rilevato (count: %d)", self.ring_count)
             return {'type': 'ring', 'count': self.ring_count, 'timestamp': current_time}
         return None
         
@@ -37,7 +38,7 @@ class RingDetector:
     def is_ringing(self):
         if not self.in_call_state:
             return False
-        current_time = time.time()
+        current_time = time.monotonic()
         if self.last_ring_time and (current_time - self.last_ring_time) > self.ring_timeout:
             self.reset()
             return False
@@ -0,0 +1,136 @@
+"""Motore regole: allow/block con priorità e fasce orarie, compilate in un unico trie."""
+import time
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 7 * 24
+ALWAYS = (1 << HOURS_PER_WEEK) - 1
+BLACKLIST_PRIORITY = 0
+ALLOWLIST_PRIORITY = 100
+DEFAULT_RULE_PRIORITY = 50
+EXACT = ''  # chiave del nodo per le regole su numero esatto (mai una cifra)
+
+# mask: un bit per ora della settimana (giorno * 24 + ora, lunedì = 0)
+Rule = namedtuple('Rule', 'reason action priority mask pattern exact')
+
+def _parse_span(text, limit):
+    # "9-20" → ore 9..19 (fine esclusa); per i giorni "0-4" → lun..ven (fine inclusa, limit 7)
+    start, _, end = str(text).partition('-')
+    start = int(start)
+    end = int(end) if end else start + (1 if limit == 24 else 0)
+    if limit == 7:
+        end += 1
+    if not (0 <= start < limit and 0 <= end <= limit):
+        raise ValueError(f"fascia non valida: {text}")
+    if start < end:
+        return list(range(start, end))
+    return list(range(start, limit)) + list(range(0, end))
+
+def schedule_mask(days=None, hours=None):
+    day_list = _parse_span(days, 7) if days not in (None, '') else range(7)
+    hour_list = _parse_span(hours, 24) if hours not in (None, '') else range(24)
+    mask = 0
+    for day in day_list:
+        for hour in hour_list:
+            mask |= 1 << (day * 24 + hour)
+    return mask
+
+_bucket_span = (0.0, 0.0, 0)
+
+def current_bucket(now=None):
+    # localtime() solo al cambio d'ora: nel resto dell'ora basta un confronto
+    global _bucket_span
+    now = time.time() if now is None else now
+    start, end, bucket = _bucket_span
+    if start <= now < end:
+        return bucket
+    t = time.localtime(now)
+    start = now - t.tm_min * 60 - t.tm_sec - (now % 1)
+    bucket = t.tm_wday * 24 + t.tm_hour
+    _bucket_span = (start, start + 3600, bucket)
+    return bucket
+
+def compile_rule(rule):
+    # Regola dal file black-list: {"id", "action", "prefix" | "number", "priority", "days", "hours"}
+    action = rule.get('action', 'block')
+    if action not in ('allow', 'block'):
+        raise ValueError(f"azione non valida: {action}")
+    if not rule.get('id'):
+        raise ValueError("regola senza id")
+    exact = 'number' in rule
+    pattern = rule['number'] if exact else rule.get('prefix', '')
+    return Rule(f"rule:{rule['id']}", action, int(rule.get('priority', DEFAULT_RULE_PRIORITY)),
+                schedule_mask(rule.get('days'), rule.get('hours')), pattern, exact)
+
+def blacklist_prefix_rule(prefix):
+    return Rule(f"prefix_match:{prefix}", 'block', BLACKLIST_PRIORITY, ALWAYS, prefix, False)
+
+def allow_number_rule(number):
+    return Rule(f"allowlist:{number}", 'allow', ALLOWLIST_PRIORITY, ALWAYS, number, True)
+
+def allow_prefix_rule(prefix):
+    return Rule(f"allowlist_prefix:{prefix}", 'allow', ALLOWLIST_PRIORITY, ALWAYS, prefix, False)
+
+class RuleEngine:
+    # Ogni nodo del trie tiene le regole che terminano lì, ordinate per priorità decrescente:
+    # una sola discesa per chiamata, a ogni livello basta la prima regola attiva nell'ora corrente
+    def __init__(self):
+        self.trie = {}
+        self.count = 0
+
+    def add(self, rule):
+        node = self.trie
+        for ch in rule.pattern:
+            node = node.setdefault(ch, {})
+        slot = EXACT if rule.exact else None
+        existing = node.get(slot, [])
+        rules = [r for r in existing if r.reason != rule.reason]
+        if len(rules) == len(existing):
+            self.count += 1
+        rules.append(rule)
+        # A parità di priorità vince allow (eccezioni esplicite)
+        rules.sort(key=lambda r: (-r.priority, r.action != 'allow'))
+        node[slot] = rules
+
+    def remove(self, pattern, reason, exact=False):
+        node = self.trie
+        for ch in pattern:
+            node = node.get(ch)
+            if node is None:
+                return False
+        slot = EXACT if exact else None
+        rules = node.get(slot)
+        if not rules:
+            return False
+        kept = [r for r in rules if r.reason != reason]
+        if len(kept) == len(rules):
+            return False
+        self.count -= 1
+        if kept:
+            node[slot] = kept
+        else:
+            del node[slot]
+        return True
+
+    def match(self, number, bucket):
+        # Regola vincente: priorità più alta; a parità, il match più lungo
+        node = self.trie
+        best = self._pick(node.get(None), bucket, None)
+        for ch in number:
+            node = node.get(ch)
+            if node is None:
+                return best
+            best = self._pick(node.get(None), bucket, best)
+        return self._pick(node.get(EXACT), bucket, best)
+
+    @staticmethod
+    def _pick(rules, bucket, best):
+        if rules:
+            for rule in rules:
+                if rule.mask >> bucket & 1:
+                    if best is None or rule.priority >= best.priority:
+                        return rule
+                    break
+        return best
@@ -1,7 +1,11 @@
 """Gestione della porta seriale in modalità raw bidirezionale."""
 import serial
+import os
+import select
+import threading
 import time
 import logging
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +15,14 @@ class SerialHandler:
         self.baudrate = baudrate
         self.timeout = timeout
         self.ser = None
+        self.read_chunk = 4096
+        self._rx_buffer = bytearray()
+        self._lines = deque()
+        self.errors = 0
+        # Pipe di risveglio (una per apertura): close() da un altro thread interrompe la select in attesa
+        self._wake_r = self._wake_w = None
+        self._closing = False
+        self._io_lock = threading.Lock()
         
     def open(self):
         try:
@@ -22,6 +34,10 @@ class SerialHandler:
             )
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
+            self._rx_buffer.clear()
+            self._lines.clear()
+            self._wake_r, self._wake_w = os.pipe()
+            self._closing = False
             logger.info(f"Porta seriale aperta: {self.device} @ {self.baudrate} baud")
             return True
         except serial.SerialException as e:
@@ -30,37 +46,87 @@ class SerialHandler:
             
     def close(self):
         if self.ser and self.ser.is_open:
-            self.ser.close()
+            # Sveglia la select in corso e aspetta che la lasci: i fd si chiudono solo quando nessuno li usa
+            self._closing = True
+            os.write(self._wake_w, b'\0')
+            with self._io_lock:
+                self.ser.close()
+                os.close(self._wake_r)
+                os.close(self._wake_w)
+                self._wake_r = self._wake_w = None
             logger.info("Porta seriale chiusa")
             
+    def fileno(self):
+        return self.ser.fileno()
+
+    def _fill(self, timeout):
+        # Attende dati sul fd (select: nessun consumo di CPU a linea ferma) e legge a blocchi
+        with self._io_lock:
+            if self._closing:
+                return False
+            try:
+                readable, _, _ = select.select([self.ser.fileno(), self._wake_r], [], [], timeout)
+            except InterruptedError:
+                return False
+            if self._wake_r in readable:
+                os.read(self._wake_r, 64)
+                return False
+            if not readable:
+                return False
+            chunk = os.read(self.ser.fileno(), self.read_chunk)
+        if not chunk:
+            raise serial.SerialException("Device seriale disconnesso")
+        self._rx_buffer += chunk
+        self._split_lines()
+        return True
+
+    def _split_lines(self):
+        buf = self._rx_buffer
+        end = max(buf.rfind(b'\n'), buf.rfind(b'\r')) + 1
+        if not end:
+            return
+        for raw in buf[:end].replace(b'\r', b'\n').split(b'\n'):
+            decoded = raw.decode('ascii', errors='ignore').strip()
+            if decoded:
+                logger.debug("RX: %s", decoded)
+                self._lines.append(decoded)
+        del buf[:end]
+
+    def read_lines(self, timeout=None):
+        # Restituisce le righe complete, attendendo al massimo timeout (None: indefinitamente)
+        if not self.ser or not self.ser.is_open:
+            return []
+        try:
+            if not self._lines and self._fill(timeout):
+                while self._fill(0):
+                    pass
+        except (OSError, serial.SerialException):
+            self.errors += 1
+            raise
+        lines = list(self._lines)
+        self._lines.clear()
+        return lines
+
     def read_line(self, timeout_override=None):
         if not self.ser or not self.ser.is_open:
             return None
-        old_timeout = None
-        if timeout_override is not None:
-            old_timeout = self.ser.timeout
-            self.ser.timeout = timeout_override
         try:
-            line = self.ser.readline()
-            if line:
-                decoded = line.decode('ascii', errors='ignore').strip()
-                if decoded:
-                    logger.debug(f"RX: {decoded}")
-                    return decoded
+            if not self._lines:
+                timeout = self.timeout if timeout_override is None else timeout_override
+                deadline = time.monotonic() + timeout
+                while not self._lines:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._fill(remaining):
+                        break
+            if self._lines:
+                return self._lines.popleft()
         except Exception as e:
+            self.errors += 1
             logger.error(f"Errore lettura seriale: {e}")
-        finally:
-            if old_timeout is not None:
-                self.ser.timeout = old_timeout
         return None
         
     def read_available(self):
-        lines = []
-        while self.ser and self.ser.is_open and self.ser.in_waiting > 0:
-            line = self.read_line()
-            if line:
-                lines.append(line)
-        return lines
+        return self.read_lines(timeout=0)
         
     def write_command(self, command, wait_response=True, response_timeout=2.0):
         if not self.ser or not self.ser.is_open:
@@ -68,26 +134,26 @@ class SerialHandler:
             return []
         cmd_bytes = (command + '\r').encode('ascii')
         self.ser.write(cmd_bytes)
-        logger.debug(f"TX: {command}")
+        logger.debug("TX: %s", command)
         if not wait_response:
             return []
         response = []
-        start_time = time.time()
-        while (time.time() - start_time) < response_timeout:
-            line = self.read_line(timeout_override=0.1)
+        deadline = time.monotonic() + response_timeout
+        while time.monotonic() < deadline:
+            line = self.read_line(timeout_override=deadline - time.monotonic())
             if line:
                 response.append(line)
                 if line in ['OK', 'ERROR']:
                     break
         return response
         
-    def send_ata(self):
+    def send_ata(self, wait_response=True):
         logger.info("Invio ATA (risposta)")
-        return self.write_command('ATA', wait_response=True, response_timeout=5.0)
+        return self.write_command('ATA', wait_response=wait_response, response_timeout=5.0)
         
-    def send_ath(self):
+    def send_ath(self, wait_response=True):
         logger.info("Invio ATH (riattacco)")
-        return self.write_command('ATH', wait_response=True, response_timeout=2.0)
+        return self.write_command('ATH', wait_response=wait_response, response_timeout=2.0)
         
     def initialize_modem(self):
         logger.info("Inizializzazione modem...")
@@ -0,0 +1,26 @@
+"""Test della normalizzazione dei prefissi: un prefisso solo internazionale non deve bloccare tutto."""
+import pytest
+
+from number_normalizer import NumberNormalizer
+
+def test_international_only_prefix_rejected():
+    normalizer = NumberNormalizer('39')
+    for prefix in ('00', '+', '0 0', '+ '):
+        with pytest.raises(ValueError):
+            normalizer.canonical_prefix(prefix)
+    with pytest.raises(ValueError):
+        normalizer.normalize_entry('prefixes', '00')
+
+def test_international_prefix_with_country_code_kept():
+    normalizer = NumberNormalizer('39')
+    assert normalizer.canonical_prefix('0044') == '+44'
+    assert normalizer.canonical_prefix('+440') == '+440'
+    assert normalizer.canonical_prefix('02') == '+3902'
+    with pytest.raises(ValueError):
+        NumberNormalizer('1').canonical_prefix('011')
+
+def test_invalid_prefix_skipped_on_load():
+    normalizer = NumberNormalizer('39')
+    assert normalizer.canonical_prefixes(['00', '0044']) == {'+44'}
+    data = normalizer.normalize_blacklist({'prefixes': ['00', '02'], 'allow_prefixes': ['+']})
+    assert data['prefixes'] == ['+3902'] and data['allow_prefixes'] == []